@@ -0,0 +1,153 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from contextlib import nullcontext
+from json import dumps
+from multiprocessing import get_context
+from pathlib import Path
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+import sys
+from time import perf_counter
+from typing import Optional, TextIO
+from pydantic import BaseModel, ValidationError
+from typer import BadParameter, Typer
+
+from data import LAZY_ANNOTATIONS, type_adapter
+from paper import Operation, Strategy, anonymize_file
+from profiling import profiled
+
+
+class Job(BaseModel):
+    input: str
+    output: str
+    operation: Operation
+    m: int = 10
+    k: int = 10
+    strategy: Strategy = Strategy.qi
+
+
+class JobResult(BaseModel):
+    job: Job
+    seconds: float
+    error: str | None = None
+
+
+def warm():
+    # Every worker builds the adapters once, the jobs it runs afterwards reuse
+    # them through type_adapter
+    for annotation in LAZY_ANNOTATIONS:
+        type_adapter(annotation)
+    type_adapter(dict[int, list[str]])
+
+
+def run_job(job: Job, cache_dir: Path | None) -> JobResult:
+    start = perf_counter()
+    try:
+        anonymize_file(
+            job.operation,
+            job.input,
+            job.output,
+            job.m,
+            job.k,
+            cache_dir,
+            strategy=job.strategy,
+        )
+    except Exception as e:
+        return JobResult(job=job, seconds=perf_counter() - start, error=repr(e))
+    return JobResult(job=job, seconds=perf_counter() - start)
+
+
+def read_manifest(manifest: TextIO) -> Iterator[Job]:
+    for i, line in enumerate(manifest, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield Job.model_validate_json(line)
+        except ValidationError as e:
+            raise BadParameter(f"line {i} of the manifest: {e}")
+
+
+def run_jobs(
+    jobs: Iterable[Job], pool: Executor, cache_dir: Path | None, max_pending: int
+) -> Iterator[JobResult]:
+    # At most max_pending jobs are submitted at a time, so that a long manifest
+    # is never read in memory all at once
+    pending: set[Future[JobResult]] = set()
+    for job in jobs:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (future.result() for future in done)
+        pending.add(pool.submit(run_job, job, cache_dir))
+    for future in wait(pending).done:
+        yield future.result()
+
+
+class JobServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket: Path, pool: Executor, cache_dir: Path | None):
+        super().__init__(str(socket), JobHandler)
+        self.pool = pool
+        self.cache_dir = cache_dir
+
+
+class JobHandler(StreamRequestHandler):
+    # One job per line, answered by one result per line once it is done
+    server: JobServer
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                job = Job.model_validate_json(line)
+            except ValidationError as e:
+                response = dumps({"error": str(e)})
+            else:
+                future = self.server.pool.submit(run_job, job, self.server.cache_dir)
+                response = future.result().model_dump_json()
+            self.wfile.write(response.encode() + b"\n")
+
+
+def worker_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(workers, get_context("forkserver"), warm)
+
+
+app = Typer(pretty_exceptions_enable=False)
+
+
+@app.command()
+@profiled
+def main(
+    manifest: Optional[Path] = None,
+    socket: Optional[Path] = None,
+    workers: int = 4,
+    cache_dir: Optional[Path] = None,
+    report: Optional[Path] = None,
+):
+    if (manifest is None) == (socket is None):
+        raise BadParameter("either a manifest or a socket is needed")
+    with worker_pool(workers) as pool:
+        if socket is not None:
+            socket.unlink(missing_ok=True)
+            with JobServer(socket, pool, cache_dir) as server:
+                server.serve_forever()
+            return
+        assert manifest is not None
+        start = perf_counter()
+        failed = 0
+        with open(manifest, "rt") as f, (
+            nullcontext(sys.stdout) if report is None else open(report, "wt")
+        ) as out:
+            for result in run_jobs(read_manifest(f), pool, cache_dir, 2 * workers):
+                failed += result.error is not None
+                print(result.model_dump_json(), file=out, flush=True)
+        print(f"{failed} failed in {perf_counter() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    app()
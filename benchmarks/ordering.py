@@ -0,0 +1,62 @@
+from __future__ import annotations
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+from typer import Typer
+
+from data import Data, User
+from benchmarks.synthetic import synthetic_users
+from generator import generate_following
+from paper import PartitionStats, Strategy, compute_classes
+from profiling import profiled
+
+app = Typer()
+
+
+def scale_free(users: int, seed: int) -> Data:
+    # Hub-heavy following graph like the generator's, with synthetic profiles
+    nodes = synthetic_users(users, seed)
+    following = generate_following(nodes, seed, 0.41, 0.54, 0.05, 0.2, 0)
+    return Data(users=nodes, following=following)
+
+
+def spread(classes: list[frozenset[User]]) -> float:
+    # Mean range of the birth dates within a class, in days: how much a uniform
+    # list blurs the QI of its users
+    ranges = [
+        (max(u.birth_date for u in c) - min(u.birth_date for u in c)).days
+        for c in classes
+    ]
+    return sum(ranges) / len(ranges)
+
+
+@app.command()
+@profiled
+def main(
+    input: Optional[Path] = None,
+    users: int = 5000,
+    m: list[int] = [10],
+    strategy: list[Strategy] = [*Strategy],
+    seed: int = 42,
+):
+    data = (
+        scale_free(users, seed) if input is None else Data.load(str(input), lazy=True)
+    )
+    print(
+        f"{'strategy':<10} {'m':>4} {'seconds':>8} {'classes':>8}"
+        f" {'scans/vertex':>13} {'spread':>8}"
+    )
+    for size in m:
+        for s in strategy:
+            stats = PartitionStats()
+            start = perf_counter()
+            classes = compute_classes(data, size, strategy=s, stats=stats)
+            seconds = perf_counter() - start
+            print(
+                f"{s:<10} {size:>4} {seconds:>8.2f} {len(classes):>8}"
+                f" {stats.scans_per_vertex:>13.1f} {spread(classes):>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    app()
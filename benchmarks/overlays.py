@@ -0,0 +1,66 @@
+from __future__ import annotations
+from collections.abc import Callable, Sequence
+from time import perf_counter
+from typing import Any
+import networkx as nx
+from typer import Typer
+
+from data import Data
+from benchmarks.synthetic import synthetic_data, synthetic_users
+from paper import AnonymizedData, Operation, anonymize_data, prefix_pattern
+from profiling import profiled
+
+app = Typer()
+
+
+def shard(users: int, seed: int) -> Data:
+    # Small synthetic tenant shard, Faker would dominate the setup
+    nodes = synthetic_users(users, seed, prefix=f"user{seed}-")
+    graph = nx.gnp_random_graph(users, 4 / users, seed=seed, directed=True)
+    # Every user interacts with someone, otherwise it would get no class
+    graph.add_edges_from((i, (i + 1) % users) for i in range(users))
+    return synthetic_data(nodes, graph)
+
+
+def best[T](f: Callable[[], T], repeat: int) -> tuple[float, T]:
+    times: list[float] = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = f()
+        times.append(perf_counter() - start)
+    return min(times), result
+
+
+def report(name: str, seconds: float, count: int):
+    print(f"{name:<16} {seconds * 1e6 / count:10.1f} us/overlay")
+
+
+def bench(
+    name: str,
+    model: type[Data] | type[AnonymizedData],
+    documents: Sequence[str],
+    repeat: int,
+):
+    seconds, loaded = best(
+        lambda: [model.model_validate_json(d) for d in documents], repeat
+    )
+    report(f"{name} load", seconds, len(documents))
+    seconds, _ = best(lambda: [o.model_dump_json() for o in loaded], repeat)
+    report(f"{name} dump", seconds, len(documents))
+
+
+@app.command()
+@profiled
+def main(shards: int = 500, users: int = 50, repeat: int = 3, seed: int = 42):
+    data = [shard(users, seed + i) for i in range(shards)]
+    bench("data", Data, [d.model_dump_json() for d in data], repeat)
+    anonymized: list[Any] = [
+        anonymize_data(d, Operation.uniform_list, 5, prefix_pattern(3)) for d in data
+    ]
+    bench(
+        "anonymized", AnonymizedData, [a.model_dump_json() for a in anonymized], repeat
+    )
+
+
+if __name__ == "__main__":
+    app()
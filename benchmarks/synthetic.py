@@ -0,0 +1,42 @@
+from __future__ import annotations
+from datetime import date
+import random
+from networkx import DiGraph
+from data import Data, Gender, User
+
+
+def synthetic_users(
+    n: int, seed: int | None = None, prefix: str = "user"
+) -> list[User]:
+    # Users without Faker, for tests and benchmarks. The quasi identifiers
+    # cycle through a few values, or are drawn from seed when one is given
+    rng = None if seed is None else random.Random(seed)
+    return [
+        User(
+            username=f"{prefix}{i}",
+            name="Name" if rng is None else f"name{i}",
+            surname="Surname" if rng is None else f"surname{i}",
+            birth_date=(
+                date(2000, 1, i % 28 + 1)
+                if rng is None
+                else date(1950 + rng.randrange(60), 1 + rng.randrange(12), 1)
+            ),
+            gender=[*Gender][i % 3] if rng is None else rng.choice([*Gender]),
+            cap=16154 + i if rng is None else rng.randrange(100000),
+            address="Via Roma 1, Genova" if rng is None else f"Via Roma {i}, Genova",
+            city="Genova",
+            phone_number=(
+                "3791211697" if rng is None else f"{rng.randrange(10**10):010}"
+            ),
+            email=f"user{i}@example.com",
+        )
+        for i in range(n)
+    ]
+
+
+def synthetic_data(users: list[User], graph: DiGraph[int]) -> Data:
+    # The following graph is given over the positions of the users
+    following: DiGraph[User] = DiGraph()
+    following.add_nodes_from(users)
+    following.add_edges_from((users[u], users[v]) for u, v in graph.edges())
+    return Data(users=users, following=following)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from hashlib import file_digest, sha256
+from json import dumps
+from os import replace, utime
+from pathlib import Path
+from shutil import copyfile
+from tempfile import NamedTemporaryFile
+
+
+def digest_file(file: Path) -> str:
+    with open(file, "rb") as f:
+        return file_digest(f, "sha256").hexdigest()
+
+
+def cache_key(*parts: object) -> str:
+    # Every part is rendered as JSON, so parameters must be plain values
+    return sha256(dumps(parts, default=str).encode()).hexdigest()
+
+
+# Suffix of the entries being written
+TEMP = ".tmp"
+
+
+@dataclass
+class ResultCache:
+    # Content addressed results. The modification time of an entry is bumped on
+    # every hit, and the least recently used entries are evicted once the
+    # directory grows past max_bytes
+    directory: Path
+    max_bytes: int = 2**30
+
+    def path(self, key: str, suffix: str) -> Path:
+        return self.directory / key[:2] / f"{key}{suffix}"
+
+    def get(self, key: str, suffix: str) -> Path | None:
+        file = self.path(key, suffix)
+        try:
+            utime(file)
+        except FileNotFoundError:
+            return None
+        return file
+
+    def restore(self, key: str, suffix: str, output: Path) -> bool:
+        file = self.get(key, suffix)
+        if file is None:
+            return False
+        copyfile(file, output)
+        return True
+
+    def put_bytes(self, key: str, suffix: str, data: bytes) -> Path:
+        file = self.path(key, suffix)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so a concurrent reader never sees a partial
+        # entry. Room is made before the rename, so the new entry is never the
+        # one evicted, even when it is larger than the budget
+        with NamedTemporaryFile(dir=file.parent, suffix=TEMP, delete=False) as tmp:
+            tmp.write(data)
+        self.evict(file, len(data))
+        replace(tmp.name, file)
+        return file
+
+    def put_file(self, key: str, suffix: str, source: Path) -> Path:
+        return self.put_bytes(key, suffix, source.read_bytes())
+
+    def entries(self) -> list[Path]:
+        return [
+            f
+            for f in self.directory.glob("*/*")
+            if f.is_file() and not f.name.endswith(TEMP)
+        ]
+
+    def evict(self, keep: Path | None = None, incoming: int = 0):
+        # Least recently used first, until the entries and the incoming bytes
+        # fit the budget
+        entries = [(f, f.stat()) for f in self.entries() if f != keep]
+        size = incoming + sum(stat.st_size for _, stat in entries)
+        for file, stat in sorted(entries, key=lambda e: e[1].st_mtime_ns):
+            if size <= self.max_bytes:
+                break
+            file.unlink(missing_ok=True)
+            size -= stat.st_size
@@ -1,20 +1,36 @@
 from abc import abstractmethod
+from functools import cache
+from hashlib import file_digest, sha256
+from collections.abc import Iterable, Iterator, Sequence
 from dataclasses import dataclass
 from datetime import date
-from json import dump, dumps, load, loads
+from io import StringIO
+from json import JSONDecodeError, JSONDecoder, dump, dumps, load, loads
+from json.encoder import encode_basestring_ascii  # type: ignore
+from pathlib import Path
+from typing import BinaryIO, TextIO
 from pydantic import (
+    ConfigDict,
     TypeAdapter,
     BaseModel,
+    ValidationError,
 )
 from networkx import DiGraph, Graph
 import networkx as nx
 from enum import StrEnum, auto
-from typing import TYPE_CHECKING, Any, Self, get_type_hints, override
+from types import NoneType, UnionType
+from typing import TYPE_CHECKING, Any, Self, get_args, get_type_hints, override
+from profiling import memory_stage
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
 
 if not TYPE_CHECKING:
     DiGraph.__class_getitem__ = lambda _: DiGraph
     Graph.__class_getitem__ = lambda _: Graph
 
+DUMP_BUFFER = 2**20
+
 
 class Gender(StrEnum):
     MALE = auto()
@@ -26,6 +42,9 @@ type ID = str
 
 
 class User(BaseModel):
+    # The schema is only built on the first validation, not at import
+    model_config = ConfigDict(defer_build=True)
+
     username: ID  # EI
     name: str  # EI
     surname: str  # EI
@@ -45,6 +64,291 @@ class User(BaseModel):
         return hash(self.username)
 
 
+# Columns of a UserTable that are not kept as Python objects
+COLUMN_TYPES = {"birth_date": "datetime64[D]", "cap": "int64"}
+# What a lazy load validates: the columns of the users and the adjacency of
+# every graph
+USER_COLUMNS: dict[str, Any] = {
+    field: list[info.annotation]  # type: ignore
+    for field, info in User.model_fields.items()
+}
+ADJACENCY = dict[str, list[str]]
+LAZY_ANNOTATIONS = [*USER_COLUMNS.values(), ADJACENCY]
+
+
+class UserTable:
+    # Users stored column by column. Rows are proxies reading their fields from
+    # the columns, a validated User is only built by UserRow.model()
+    def __init__(self, columns: "dict[str, NDArray[Any]]"):
+        self.columns = columns
+        self.rows = [UserRow(self, i) for i in range(len(columns["username"]))]
+
+    @classmethod
+    def from_records(cls, records: Sequence[dict[str, Any]]) -> "UserTable":
+        import numpy as np
+
+        # Validated a column at a time, as strictly as User but without
+        # building a model per record
+        columns: "dict[str, NDArray[Any]]" = {}
+        for field, annotation in USER_COLUMNS.items():
+            try:
+                values = [r[field] for r in records]
+            except KeyError:
+                raise ValueError(f"a user has no {field}") from None
+            adapter = type_adapter(annotation)
+            try:
+                values = adapter.validate_python(values)
+            except ValidationError as e:
+                error = e.errors()[0]
+                raise ValueError(
+                    f"user {error['loc'][0]} has an invalid {field}: {error['msg']}"
+                ) from None
+            columns[field] = np.array(values, COLUMN_TYPES.get(field, object))
+        return cls(columns)
+
+    def __getattr__(self, field: str) -> "NDArray[Any]":
+        try:
+            return self.__dict__["columns"][field]
+        except KeyError:
+            raise AttributeError(field) from None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index: int) -> "UserRow":
+        return self.rows[index]
+
+    def __iter__(self) -> Iterator["UserRow"]:
+        return iter(self.rows)
+
+    def value(self, field: str, index: int) -> Any:
+        value = self.columns[field][index]
+        match field:
+            case "birth_date" | "cap":
+                return value.item()
+            case "gender":
+                return Gender(value)
+            case _:
+                return value
+
+    def positions(self, rows: Iterable["UserRow"]) -> "NDArray[Any]":
+        import numpy as np
+
+        return np.fromiter((row.index for row in rows), np.intp)
+
+    def model_dump(self) -> list[dict[str, Any]]:
+        import numpy as np
+
+        columns = [
+            np.datetime_as_string(values).tolist()
+            if field == "birth_date"
+            else values.tolist()
+            for field, values in self.columns.items()
+        ]
+        return [dict(zip(self.columns, row)) for row in zip(*columns)]
+
+
+class UserRow:
+    # Stands in for a User in graphs and classes: hashed by username like a
+    # User, equal to the users with the same fields
+    __slots__ = ("table", "index", "hash")
+
+    def __init__(self, table: UserTable, index: int):
+        self.table = table
+        self.index = index
+        self.hash = hash(table.columns["username"][index])
+
+    def __getattr__(self, field: str) -> Any:
+        if field not in User.model_fields:
+            raise AttributeError(field)
+        return self.table.value(field, self.index)
+
+    age = User.age
+
+    def model(self) -> User:
+        return User.model_validate(
+            {field: getattr(self, field) for field in User.model_fields}
+        )
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, UserRow) and other.table is self.table:
+            return other.index == self.index
+        if isinstance(other, UserRow | User):
+            return all(
+                getattr(self, field) == getattr(other, field)
+                for field in User.model_fields
+            )
+        return NotImplemented
+
+    def __repr__(self):
+        return f"UserRow({self.username!r})"
+
+
+class JSONStream:
+    def __init__(self, file: TextIO, block_size: int = 2**16):
+        self.file = file
+        self.block_size = block_size
+        self.buffer = ""
+        self.position = 0
+        self.decoder = JSONDecoder()
+
+    def _fill(self) -> bool:
+        block = self.file.read(self.block_size)
+        if not block:
+            return False
+        self.buffer = self.buffer[self.position :] + block
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.position < len(self.buffer):
+                if not self.buffer[self.position].isspace():
+                    return self.buffer[self.position]
+                self.position += 1
+            if not self._fill():
+                raise EOFError("unexpected end of the JSON document")
+
+    def expect(self, characters: str) -> str:
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f"expected one of {characters!r}, got {character!r}")
+        self.position += 1
+        return character
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                result, end = self.decoder.raw_decode(self.buffer, self.position)
+            except JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer might continue in the next block
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.position = end
+            return result
+
+    def items(self) -> Iterator[Any]:
+        if self.peek() not in "[{":
+            yield self.value()
+            return
+        closing = "]" if self.expect("[{") == "[" else "}"
+        if self.peek() == closing:
+            self.expect(closing)
+            return
+        while True:
+            if closing == "}":
+                key = self.value()
+                self.expect(":")
+                yield key, self.value()
+            else:
+                yield self.value()
+            if self.expect("," + closing) == closing:
+                return
+
+
+def iter_field(
+    file: str | Path, field: str, block_size: int = 2**16
+) -> Iterator[Any]:
+    # Yields the elements of a top level array, or the (key, value) pairs of a
+    # top level object, holding a single element in memory at a time
+    with open(file, "rt") as f:
+        stream = JSONStream(f, block_size)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == field:
+                yield from stream.items()
+                return
+            for _ in stream.items():
+                pass
+            if stream.expect(",}") == "}":
+                return
+
+
+class DigestWriter:
+    # Gathers the text in blocks of DUMP_BUFFER characters, each block is hashed
+    # and written at once. The JSON is ASCII only, so characters are bytes
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.digest = sha256()
+        self.size = 0
+        self.pending: list[str] = []
+        self.buffered = 0
+
+    def write(self, text: str) -> int:
+        self.pending.append(text)
+        self.buffered += len(text)
+        if self.buffered >= DUMP_BUFFER:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        data = "".join(self.pending).encode()
+        self.digest.update(data)
+        self.size += len(data)
+        self.file.write(data)
+        self.pending.clear()
+        self.buffered = 0
+
+
+class Manifest(BaseModel):
+    model_config = ConfigDict(defer_build=True)
+
+    sha256: str
+    size: int
+    nodes: int
+    edges: dict[str, int]
+
+    def check(self, file: str | Path):
+        if Path(file).stat().st_size != self.size:
+            raise ValueError(f"{file} does not have the size of its manifest")
+        with open(file, "rb") as f:
+            if file_digest(f, "sha256").hexdigest() != self.sha256:
+                raise ValueError(f"{file} does not match the digest of its manifest")
+
+
+@cache
+def type_adapter[T](annotation: type[T]) -> TypeAdapter[T]:
+    # Building an adapter costs far more than validating a small document, so
+    # they are shared by every load and dump of the process
+    return TypeAdapter(annotation)
+
+
+@dataclass(frozen=True)
+class Schema:
+    fields: dict[str, type[object]]
+    graph_fields: list[str]
+    # Fields annotated as X | None: missing from a document when they are None
+    optional: set[str]
+
+
+@cache
+def schema(cls: type) -> Schema:
+    # Type hints are resolved once per class instead of on every load and dump
+    fields: dict[str, type[object]] = {}
+    optional: set[str] = set()
+    for field, annotation in get_type_hints(cls).items():
+        if isinstance(annotation, UnionType) and NoneType in get_args(annotation):
+            (annotation,) = [a for a in get_args(annotation) if a is not NoneType]
+            optional.add(field)
+        fields[field] = annotation
+    return Schema(
+        fields,
+        [field for field, a in fields.items() if issubclass(a, Graph)],
+        optional,
+    )
+
+
 class CustomModel:
     @classmethod
     def load(cls, file: str) -> Self:
@@ -54,9 +358,10 @@ class CustomModel:
     @classmethod
     def model_validate(cls, data: object) -> Self:
         assert isinstance(data, dict)
-        annotations: dict[str, type[object]] = get_type_hints(cls)
         kwargs: dict[str, object] = {}
-        for field, annotation in annotations.items():
+        for field, annotation in schema(cls).fields.items():
+            if field in schema(cls).optional and data.get(field) is None:
+                continue
             kwargs[field] = cls._validate_field(field, annotation, data[field], kwargs)
         return cls(**kwargs)
 
@@ -65,22 +370,22 @@ class CustomModel:
         return cls.model_validate(loads(json))
 
     def model_dump(self) -> dict[str, Any]:
-        annotations: dict[str, type[object]] = get_type_hints(self.__class__)
         result: dict[str, object] = {}
-        for field, annotation in annotations.items():
-            input: object = getattr(self, field)
+        for field, annotation, input in self._present_fields():
             result[field] = self._dump_field(field, annotation, input)
 
         return result
 
+    def _present_fields(self) -> Iterator[tuple[str, type[object], object]]:
+        optional = schema(self.__class__).optional
+        for field, annotation in schema(self.__class__).fields.items():
+            input: object = getattr(self, field)
+            if input is not None or field not in optional:
+                yield field, annotation, input
+
     @classmethod
     def graph_fields(cls) -> list[str]:
-        annotations: dict[str, type[object]] = get_type_hints(cls)
-        return [
-            field
-            for field, annotation in annotations.items()
-            if issubclass(annotation, Graph)
-        ]
+        return schema(cls).graph_fields
 
     def model_dump_json(self) -> str:
         return dumps(self.model_dump())
@@ -120,37 +425,74 @@ class GraphOverlay[T](CustomModel):
     @override
     def model_validate(cls, data: object) -> Self:
         assert isinstance(data, dict)
-        result = super().model_validate(data)
-        nodes_load_map = {i: o for i, o in result._nodes_map()}
-        for field, graph in result.all_graphs().items():
-            input = TypeAdapter(dict[str, list[str]]).validate_python(data[field])
-            nx.relabel_nodes(
-                nx.from_dict_of_lists(input, graph), nodes_load_map, copy=False
-            )
+        with memory_stage(f"{cls.__name__}.model_validate"):
+            result = super().model_validate(data)
+            nodes_load_map = {i: o for i, o in result._nodes_map()}
+            for field, graph in result.all_graphs().items():
+                input = type_adapter(ADJACENCY).validate_python(data[field])
+                load_graph(graph, input, nodes_load_map)
         return result
 
     @classmethod
     def model_validate_json(cls, json: str) -> Self:
         return cls.model_validate(loads(json))
 
-    @classmethod
-    def graph_fields(cls) -> list[str]:
-        annotations: dict[str, type[object]] = get_type_hints(cls)
-        return [
-            field
-            for field, annotation in annotations.items()
-            if issubclass(annotation, Graph)
-        ]
-
     def all_graphs(self) -> dict[str, Graph[T]]:
-        return {field: getattr(self, field) for field in self.graph_fields()}
+        graphs = {field: getattr(self, field) for field in self.graph_fields()}
+        return {field: graph for field, graph in graphs.items() if graph is not None}
 
     def model_dump_json(self) -> str:
-        return dumps(self.model_dump())
+        buffer = StringIO()
+        self.write_json(buffer)
+        return buffer.getvalue()
+
+    def dump(self, file: str) -> Manifest:
+        # The text is hashed while it is written, so the file can be checked
+        # later without being parsed again
+        with open(file, "wb") as f:
+            writer = DigestWriter(f)
+            self.write_json(writer)  # type: ignore
+            writer.flush()
+        return Manifest(
+            sha256=writer.digest.hexdigest(),
+            size=writer.size,
+            nodes=len(self._nodes_map()),
+            edges={
+                field: graph.number_of_edges()
+                for field, graph in self.all_graphs().items()
+            },
+        )
+
+    def write_json(self, f: TextIO):
+        # Same text as json.dump(self.model_dump(), f), but the graphs are
+        # written while walking their adjacency instead of being copied first
+        nodes_dump_map = {o: i for i, o in self._nodes_map()}
+        f.write("{")
+        for n, (field, annotation, input) in enumerate(self._present_fields()):
+            f.write(f"{', ' if n else ''}{encode_basestring_ascii(field)}: ")
+            if isinstance(input, Graph):
+                write_graph(f, input, nodes_dump_map)
+            else:
+                # One shot, so that the C encoder is used
+                f.write(dumps(self._dump_field(field, annotation, input)))
+        f.write("}")
 
-    def dump(self, file: str):
-        with open(file, "wt") as f:
-            dump(self.model_dump(), f)
+    @override
+    def model_dump(self) -> dict[str, Any]:
+        # The node map is built once for all the graphs
+        nodes_dump_map = {o: i for i, o in self._nodes_map()}
+        result: dict[str, object] = {}
+        for field, annotation, input in self._present_fields():
+            if isinstance(input, Graph):
+                result[field] = {
+                    nodes_dump_map.get(u, u): [
+                        nodes_dump_map.get(v, v) for v in neighbours
+                    ]
+                    for u, neighbours in input.adjacency()
+                }
+            else:
+                result[field] = self._dump_field(field, annotation, input)
+        return result
 
     @abstractmethod
     def _nodes_map(self) -> list[tuple[str, T]]:
@@ -158,11 +500,9 @@ class GraphOverlay[T](CustomModel):
 
     @override
     def _dump_field[V](self, field_name: str, annotation: type[V], data: V) -> object:
-        nodes_dump_map = {o: i for i, o in self._nodes_map()}
-        if isinstance(data, Graph):
-            return nx.to_dict_of_lists(nx.relabel_nodes(data, nodes_dump_map))
-        else:
-            return TypeAdapter(annotation).dump_python(data, mode="json")
+        if isinstance(data, UserTable):
+            return data.model_dump()
+        return type_adapter(annotation).dump_python(data, mode="json")
 
     @override
     @classmethod
@@ -177,14 +517,65 @@ class GraphOverlay[T](CustomModel):
     ) -> V:
         if issubclass(annotation, Graph):
             return annotation()
+        elif isinstance(data, UserTable):
+            return data  # type: ignore
         else:
-            return TypeAdapter(annotation).validate_python(data)
+            return type_adapter(annotation).validate_python(data)
+
+
+def write_graph[T](f: TextIO, graph: Graph[T], nodes: dict[T, str]):
+    # One line of the adjacency at a time, parallel edges written once like
+    # nx.to_dict_of_lists does
+    f.write("{")
+    for n, (u, neighbours) in enumerate(graph.adjacency()):
+        ids = ", ".join(encode_basestring_ascii(nodes.get(v, v)) for v in neighbours)
+        f.write(
+            f"{', ' if n else ''}{encode_basestring_ascii(nodes.get(u, u))}: [{ids}]"
+        )
+    f.write("}")
+
+
+def load_graph[T](graph: Graph[T], input: dict[str, list[str]], nodes: dict[str, T]):
+    # Same node and adjacency order as building the graph from the ids and then
+    # relabelling it in place: self loops first, then every neighbour in the
+    # order the ids first appear. No edge is moved once per endpoint
+    order = dict.fromkeys(input)
+    for neighbours in input.values():
+        order.update(dict.fromkeys(neighbours))
+    rank = {i: r for r, i in enumerate(order)}
+    graph.add_nodes_from(nodes[i] for i in order)
+    sources = [i for i in order if i in input]
+    graph.add_edges_from(
+        (nodes[i], nodes[i]) for i in sources for j in input[i] if j == i
+    )
+    graph.add_edges_from(
+        (nodes[i], nodes[j])
+        for i in sources
+        for j in sorted(input[i], key=rank.__getitem__)
+        if j != i
+    )
 
 
 @dataclass
 class UserGraphOverlay(GraphOverlay[User]):
     users: list[User]
 
+    @classmethod
+    @override
+    def load(cls, file: str, lazy: bool = False) -> Self:
+        with open(file, "rt") as f:
+            return cls.model_validate(load(f), lazy)
+
+    @classmethod
+    @override
+    def model_validate(cls, data: object, lazy: bool = False) -> Self:
+        # A lazy overlay keeps its users in a UserTable, the rows of which are
+        # the nodes of its graphs
+        if lazy:
+            assert isinstance(data, dict)
+            data = {**data, "users": UserTable.from_records(data["users"])}
+        return super().model_validate(data)
+
     @override
     def _nodes_map(self) -> list[tuple[str, User]]:
         return [(user.username, user) for user in self.users]
@@ -193,3 +584,7 @@ class UserGraphOverlay(GraphOverlay[User]):
 @dataclass
 class Data(UserGraphOverlay):
     following: DiGraph[User]
+    # Optional relations, correlated with following by generator.py
+    likes: DiGraph[User] | None = None
+    comments: DiGraph[User] | None = None
+    messages: DiGraph[User] | None = None
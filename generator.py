@@ -1,11 +1,18 @@
 from __future__ import annotations
-from tqdm import tqdm
-from typer import Typer
-from faker import Faker
+from collections.abc import Mapping
+from dataclasses import dataclass, replace
+from enum import StrEnum, auto
+from typer import BadParameter, Typer
 import random
 from networkx import DiGraph, scale_free_graph, selfloop_edges
 from pathlib import Path
 from data import Gender, User, Data
+from typing import TYPE_CHECKING, Optional
+from profiling import profiled
+
+if TYPE_CHECKING:
+    from faker import Faker
+    from numpy.random import Generator
 
 typer = Typer()
 
@@ -60,37 +67,135 @@ def generate_following(
     return graph
 
 
+@dataclass(frozen=True)
+class Relation:
+    density: float  # edges drawn per user, before merging duplicates
+    follow_bias: float  # share of the edges copied from following
+    skew: float  # targets are drawn with weight (followers + 1) ** skew
+
+
+RELATIONS = {
+    "likes": Relation(density=5, follow_bias=0.6, skew=1.2),
+    "comments": Relation(density=1.5, follow_bias=0.8, skew=1),
+    "messages": Relation(density=1, follow_bias=0.9, skew=0.5),
+}
+
+
+class Scale(StrEnum):
+    S = auto()
+    M = auto()
+    L = auto()
+    XL = auto()
+
+
+# (users, density multiplier of the relations): with every relation the largest
+# preset reaches about 10M edges
+SCALES = {
+    Scale.S: (10**3, 1.0),
+    Scale.M: (10**4, 1.0),
+    Scale.L: (10**5, 1.0),
+    Scale.XL: (5 * 10**5, 2.0),
+}
+
+
+def generate_relation(
+    following: DiGraph[User], users: list[User], relation: Relation, rng: Generator
+) -> DiGraph[User]:
+    import numpy as np
+
+    # Part of the edges repeat a following edge, the others go from a random
+    # user to a target drawn by popularity among the followers
+    index = {u: i for i, u in enumerate(users)}
+    follows = np.fromiter(
+        (index[w] for e in following.edges() for w in e), np.intp
+    ).reshape(-1, 2)
+    edges = round(relation.density * len(users))
+    copied = min(rng.binomial(edges, relation.follow_bias), len(follows))
+    followers = np.fromiter(
+        (d for _, d in following.in_degree(users)), np.float64, len(users)
+    )
+    weights = (followers + 1) ** relation.skew
+    sources = rng.integers(len(users), size=edges - copied)
+    targets = rng.choice(len(users), size=edges - copied, p=weights / weights.sum())
+    pairs = np.concatenate(
+        [
+            follows[rng.choice(len(follows), size=copied, replace=False)],
+            np.stack([sources, targets], axis=1),
+        ]
+    )
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    graph: DiGraph[User] = DiGraph()
+    graph.add_edges_from((users[u], users[v]) for u, v in pairs.tolist())
+    return graph
+
+
+def preset(
+    n: int,
+    scale: Scale | None,
+    relation: list[str],
+    density: float = 1.0,
+    skew: float | None = None,
+) -> tuple[int, dict[str, Relation]]:
+    # A scale sets the number of users and, unless some are chosen, adds every
+    # relation
+    if scale is not None:
+        n, multiplier = SCALES[scale]
+        density *= multiplier
+        relation = relation or [*RELATIONS]
+    if unknown := {*relation} - {*RELATIONS}:
+        raise BadParameter(f"unknown relations {sorted(unknown)}")
+    return n, {
+        name: replace(
+            RELATIONS[name],
+            density=RELATIONS[name].density * density,
+            skew=RELATIONS[name].skew if skew is None else skew,
+        )
+        for name in relation
+    }
+
+
 def generate_data(
     n: int,
     seed: int,
-    alpha: float,
-    beta: float,
-    gamma: float,
-    delta_in: float,
-    delta_out: float,
+    alpha: float = 0.41,
+    beta: float = 0.54,
+    gamma: float = 0.05,
+    delta_in: float = 0.2,
+    delta_out: float = 0,
     progress: bool = True,
+    relations: Mapping[str, Relation] = {},
 ) -> Data:
+    # Deferred, only generating data needs them
+    from faker import Faker
+    from tqdm import tqdm
+
     random.seed(seed)
     faker = Faker("it_IT", seed=seed)
     users = [
         profile(faker)
         for _ in tqdm(range(n), desc="generating users", disable=not progress)
     ]
-    return Data(
-        users=users,
-        following=generate_following(
-            users,
-            seed=seed,
-            alpha=alpha,
-            beta=beta,
-            gamma=gamma,
-            delta_in=delta_in,
-            delta_out=delta_out,
-        ),
+    following = generate_following(
+        users,
+        seed=seed,
+        alpha=alpha,
+        beta=beta,
+        gamma=gamma,
+        delta_in=delta_in,
+        delta_out=delta_out,
     )
+    graphs = {}
+    if relations:
+        import numpy as np
+
+        for i, (name, relation) in enumerate(relations.items()):
+            rng = np.random.default_rng([seed, i])
+            graphs[name] = generate_relation(following, users, relation, rng)
+    return Data(users=users, following=following, **graphs)
 
 
 @typer.command()
+@profiled
 def main(
     out: Path,
     seed: int = 42,
@@ -100,7 +205,12 @@ def main(
     delta_in: float = 0.2,
     delta_out: float = 0,
     n: int = 10**4,
+    scale: Optional[Scale] = None,
+    relation: list[str] = [],
+    density: float = 1.0,
+    skew: Optional[float] = None,
 ):
+    n, relations = preset(n, scale, relation, density, skew)
     data = generate_data(
         seed=seed,
         alpha=alpha,
@@ -109,8 +219,9 @@ def main(
         delta_in=delta_in,
         delta_out=delta_out,
         n=n,
+        relations=relations,
     )
-    out.write_text(data.model_dump_json())
+    data.dump(str(out))
 
 
 if __name__ == "__main__":
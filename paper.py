@@ -1,16 +1,24 @@
 from __future__ import annotations
-from collections.abc import Callable, Collection, Iterable, Mapping
+from collections import deque
+from collections.abc import Callable, Collection, Iterable, Iterator, Mapping, Sequence
 from dataclasses import dataclass
+from functools import cached_property
 from enum import StrEnum, auto
 from itertools import count
-from typing import Any, Protocol, Self, override
+from json import dumps, loads
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional, Protocol, Self, override
 from networkx import Graph, MultiDiGraph
-from pydantic import TypeAdapter
-from tqdm import tqdm
 import networkx as nx
 
-from data import User, Data, GraphOverlay
+from cache import ResultCache, cache_key, digest_file
+from data import User, UserTable, Data, GraphOverlay, Manifest, type_adapter
 from typer import Typer
+from profiling import profiled
+
+if TYPE_CHECKING:
+    import numpy as np
+    from numpy.typing import NDArray
 
 
 class Ordering(Protocol):
@@ -18,6 +26,15 @@ class Ordering(Protocol):
         ...
 
 
+class Adjacency[N](Protocol):
+    # What the partition needs from a graph, met by networkx graphs and CSRGraph
+    def __iter__(self) -> Iterator[N]:
+        ...
+
+    def __getitem__(self, node: N, /) -> Iterable[N]:
+        ...
+
+
 @dataclass
 class Class[N]:
     id: int
@@ -51,7 +68,7 @@ class ClassGraphOverlay(GraphOverlay[Class[User]]):
     ) -> V:
         if field_name != "classes":
             return super()._validate_field(field_name, annotation, data, prev_fields)
-        classes = TypeAdapter(dict[int, list[str]]).validate_python(data)
+        classes = type_adapter(dict[int, list[str]]).validate_python(data)
         mapping: dict[str, User] = {u.username: u for u in prev_fields["users"]}
         return [
             Class(i, frozenset(mapping[username] for username in c))
@@ -81,22 +98,42 @@ class ClassGraphOverlay(GraphOverlay[Class[User]]):
 @dataclass
 class AnonymizedData(ClassGraphOverlay):
     following: MultiDiGraph[Class[User]]
+    likes: MultiDiGraph[Class[User]] | None = None
+    comments: MultiDiGraph[Class[User]] | None = None
+    messages: MultiDiGraph[Class[User]] | None = None
+
+
+@dataclass
+class PartitionStats:
+    vertices: int = 0
+    scans: int = 0  # classes checked before placing a vertex
+
+    @property
+    def scans_per_vertex(self) -> float:
+        return self.scans / self.vertices if self.vertices else 0.0
 
 
 def divide_nodes[
     N
 ](
-    V: Graph[N],
+    V: Adjacency[N],
     m: int,
     ordering: Callable[[N], Ordering],
     progress: bool = True,
+    order: Sequence[N] | None = None,
+    stats: PartitionStats | None = None,
 ) -> list[frozenset[N]]:
+    from tqdm import tqdm
+
     # O(|E||V|) + O(|V|log|V|)
     C: list[tuple[set[N], set[N]]] = []
+    # Classes with less than m nodes, in creation order: full ones are never
+    # scanned again
+    available: list[tuple[set[N], set[N]]] = []
 
-    def safety_condition(c: tuple[set[N], set[N]], v: N) -> bool:  # O(|V[v]|)
+    def safety_condition(c: tuple[set[N], set[N]], neighbourhood: set[N]) -> bool:
         _, sc = c
-        return not bool(sc & {*V[v], v})
+        return not bool(sc & neighbourhood)  # O(|V[v]|)
 
     def insert(c: tuple[set[N], set[N]], v: N):  # O(|V[v]|)
         cls, sc = c
@@ -107,21 +144,28 @@ def divide_nodes[
     def create_new_class():  # O(1)
         c: tuple[set[N], set[N]] = (set(), set())
         C.append(c)
+        available.append(c)
         return c
 
     # O(|V|log|V|)
-    for v in tqdm(
-        sorted(V, key=ordering), desc="creating classes", disable=not progress
-    ):  # O(|V|)
-        flag = True
-        for c in C:  # O(|V|)
-            if safety_condition(c, v) and len(c[0]) < m:  # O(|V[v]|)
-                insert(c, v)
-                flag = False
+    # order is V already sorted by ordering, when the caller has it at hand
+    nodes = sorted(V, key=ordering) if order is None else order
+    scans = 0
+    for v in tqdm(nodes, desc="creating classes", disable=not progress):  # O(|V|)
+        neighbourhood = {*V[v], v}  # O(|V[v]|)
+        for i, c in enumerate(available):  # O(|V|)
+            scans += 1
+            if safety_condition(c, neighbourhood):
                 break
-        if flag:
-            insert(create_new_class(), v)
+        else:
+            i, c = len(available), create_new_class()
+        insert(c, v)
+        if len(c[0]) >= m:
+            del available[i]
     assert {*V} == {u for c, _ in C for u in c}
+    if stats is not None:
+        stats.vertices += len(nodes)
+        stats.scans += scans
     return [frozenset(c) for c, _ in C]  # O(|V|)
 
 
@@ -157,6 +201,53 @@ def apply_uniform_lists[N](G: Graph[N], classes: dict[N, Class[N]]):
     return nx.relabel_nodes(G, classes)
 
 
+class RelabelledAtlas[K, V](Mapping[Any, V]):
+    # Read only mapping with the keys of atlas seen through a relabelling
+    def __init__(
+        self, atlas: Mapping[K, V], mapping: Mapping[K, Any], inverse: Mapping[Any, K]
+    ):
+        self.atlas = atlas
+        self.mapping = mapping
+        self.inverse = inverse
+
+    def __getitem__(self, key: Any) -> V:
+        # Keys missing from the mapping stand for themselves, the relabelled
+        # ones do not exist anymore
+        if key in self.inverse:
+            return self.atlas[self.inverse[key]]
+        if key in self.mapping:
+            raise KeyError(key)
+        return self.atlas[key]
+
+    def __iter__(self) -> Iterator[Any]:
+        return (self.mapping.get(u, u) for u in self.atlas)
+
+    def __len__(self) -> int:
+        return len(self.atlas)
+
+
+class RelabelledAdjacency[K, V](RelabelledAtlas[K, Mapping[K, V]]):
+    def __getitem__(self, key: Any) -> Mapping[Any, V]:
+        return RelabelledAtlas(super().__getitem__(key), self.mapping, self.inverse)
+
+
+def uniform_list_view[N](G: Graph[N], classes: dict[N, Class[N]]) -> Graph[Class[N]]:
+    # The graph apply_uniform_lists builds, translated on the fly instead of
+    # copied. Every user has a class of its own, so the mapping can be inverted.
+    # networkx has no public hook for this: the storage attributes are set like
+    # nx.graphviews does, which is why networkx is pinned to 3.2
+    inverse = {c: u for u, c in classes.items()}
+    view: Any = G.__class__()
+    view.graph = G.graph
+    view._node = RelabelledAtlas(G._node, classes, inverse)
+    if G.is_directed():
+        view._succ = view._adj = RelabelledAdjacency(G._succ, classes, inverse)
+        view._pred = RelabelledAdjacency(G._pred, classes, inverse)
+    else:
+        view._adj = RelabelledAdjacency(G._adj, classes, inverse)
+    return nx.freeze(view)
+
+
 def prefix_pattern(k: int):
     return range(k)
 
@@ -165,7 +256,68 @@ def ordering_function(u: User):
     return u.birth_date
 
 
-def check_anonymized[N](G: Graph[N], classes: list[frozenset[N]]) -> bool:
+def node_order(G: Adjacency[User], users: Sequence[User]) -> list[User] | None:
+    # The rows of a UserTable are sorted with a single argsort of the birth date
+    # column, stable like sorted so that equal dates keep the graph order
+    if not isinstance(users, UserTable):
+        return None
+    nodes: list[Any] = [*G]
+    keys = users.birth_date[users.positions(nodes)]
+    return [nodes[i] for i in keys.argsort(kind="stable")]
+
+
+class Strategy(StrEnum):
+    qi = auto()
+    degree = auto()
+    bfs = auto()
+    rcm = auto()
+
+
+def strategy_order[
+    N
+](G: Adjacency[N], strategy: Strategy, ordering: Callable[[N], Ordering]) -> list[N]:
+    # Placing the hubs early, or the neighbours of a vertex close to it, keeps
+    # the safety condition from failing against many classes in a row
+    degree = {v: len([*G[v]]) for v in G}
+    match strategy:
+        case Strategy.qi:
+            return sorted(G, key=ordering)
+        case Strategy.degree:
+            return sorted(G, key=lambda v: (-degree[v], ordering(v)))
+        case Strategy.bfs:
+            starts = sorted(G, key=lambda v: -degree[v])
+            return breadth_first(starts, lambda v: G[v])
+        case Strategy.rcm:
+            # Reverse Cuthill-McKee: every component from a vertex of least
+            # degree, neighbours by increasing degree
+            starts = sorted(G, key=degree.__getitem__)
+            order = breadth_first(
+                starts, lambda v: sorted(G[v], key=degree.__getitem__)
+            )
+            return order[::-1]
+
+
+def breadth_first[
+    N
+](starts: Iterable[N], neighbours: Callable[[N], Iterable[N]]) -> list[N]:
+    seen: set[N] = set()
+    order: list[N] = []
+    for start in starts:
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = deque([start])
+        while queue:
+            u = queue.popleft()
+            order.append(u)
+            for v in neighbours(u):
+                if v not in seen:
+                    seen.add(v)
+                    queue.append(v)
+    return order
+
+
+def check_anonymized[N](G: Adjacency[N], classes: list[frozenset[N]]) -> bool:
     aux = {c: cls for cls in classes for c in cls}
     for v in G:
         interactions: set[frozenset[N]] = set()
@@ -187,6 +339,77 @@ def extract_interaction_graph_from_overlay[N](overlay: GraphOverlay[N]) -> Graph
     return extract_interaction_graph(overlay.all_graphs().values())
 
 
+@dataclass(frozen=True)
+class CSRGraph[N]:
+    # Undirected graph in compressed sparse rows: the neighbours of nodes[i] are
+    # the nodes at indices[indptr[i] : indptr[i + 1]], in increasing position
+    nodes: list[N]
+    indptr: NDArray[np.intp]
+    indices: NDArray[np.intp]
+
+    @cached_property
+    def adjacency(self) -> dict[N, list[N]]:
+        neighbours = [self.nodes[j] for j in self.indices.tolist()]
+        bounds = self.indptr.tolist()
+        return {
+            u: neighbours[bounds[i] : bounds[i + 1]] for i, u in enumerate(self.nodes)
+        }
+
+    def __iter__(self) -> Iterator[N]:
+        return iter(self.nodes)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, node: object) -> bool:
+        return node in self.adjacency
+
+    def __getitem__(self, node: N) -> list[N]:
+        return self.adjacency[node]
+
+    def edges(self) -> Iterator[tuple[N, N]]:
+        bounds = self.indptr.tolist()
+        for i, u in enumerate(self.nodes):
+            for j in self.indices[bounds[i] : bounds[i + 1]].tolist():
+                if i <= j:
+                    yield u, self.nodes[j]
+
+
+def extract_interaction_csr[N](graphs: Iterable[Graph[N]]) -> CSRGraph[N]:
+    import numpy as np
+
+    # The edges of every graph are gathered in one array of ids, then made
+    # undirected and deduplicated at once instead of edge by edge
+    ids: dict[N, int] = {}
+    chunks: list[NDArray[np.intp]] = [np.empty(0, np.intp)]
+    for graph in graphs:
+        for u in graph:
+            ids.setdefault(u, len(ids))
+        chunks.append(
+            np.fromiter((ids[x] for e in graph.edges() for x in e[:2]), np.intp)
+        )
+    endpoints = np.concatenate(chunks)
+    # Nodes in the order they first appear in the edges, like the nodes of
+    # extract_interaction_graph
+    uniques, first = np.unique(endpoints, return_index=True)
+    appearance = uniques[first.argsort()]
+    n = len(appearance)
+    position = np.empty(len(ids), np.intp)
+    position[appearance] = np.arange(n)
+    edges = position[endpoints].reshape(-1, 2)
+    low, high = edges.min(axis=1), edges.max(axis=1)
+    keys = np.unique(low * n + high)
+    low, high = keys // n, keys % n
+    loops = low == high
+    rows = np.concatenate([low, high[~loops]])
+    columns = np.concatenate([high, low[~loops]])
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(n + 1, np.intp)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    nodes = [*ids]
+    return CSRGraph([nodes[i] for i in appearance.tolist()], indptr, columns[order])
+
+
 app = Typer(pretty_exceptions_enable=False)
 
 
@@ -195,30 +418,94 @@ class Operation(StrEnum):
     partitioning = auto()
 
 
+def compute_classes(
+    data: Data,
+    m: int,
+    progress: bool = False,
+    strategy: Strategy = Strategy.qi,
+    stats: PartitionStats | None = None,
+) -> list[frozenset[User]]:
+    interaction_graph = extract_interaction_csr(data.all_graphs().values())
+    if strategy == Strategy.qi:
+        order = node_order(interaction_graph, data.users)
+    else:
+        order = strategy_order(interaction_graph, strategy, ordering_function)
+    classes = divide_nodes(
+        interaction_graph,
+        m,
+        ordering_function,
+        progress=progress,
+        order=order,
+        stats=stats,
+    )
+    assert check_anonymized(interaction_graph, classes)
+    return classes
+
+
+def classes_key(digest: str, m: int, strategy: Strategy = Strategy.qi) -> str:
+    # The partition only depends on the input, on m and on the strategy, so it
+    # is shared by every operation and pattern
+    return cache_key(digest, "classes", m, strategy)
+
+
+def load_classes(data: Data, file: Path) -> list[frozenset[User]]:
+    users = {u.username: u for u in data.users}
+    return [frozenset(users[u] for u in c) for c in loads(file.read_bytes())]
+
+
+def store_classes(cache: ResultCache, key: str, classes: list[frozenset[User]]):
+    cache.put_bytes(
+        key, ".json", dumps([[u.username for u in c] for c in classes]).encode()
+    )
+
+
+def cached_classes(
+    data: Data,
+    m: int,
+    cache: ResultCache,
+    digest: str,
+    progress: bool = False,
+    strategy: Strategy = Strategy.qi,
+) -> list[frozenset[User]]:
+    key = classes_key(digest, m, strategy)
+    file = cache.get(key, ".json")
+    if file is not None:
+        return load_classes(data, file)
+    classes = compute_classes(data, m, progress, strategy)
+    store_classes(cache, key, classes)
+    return classes
+
+
 def anonymize_data(
     data: Data,
     operation: Operation,
     m: int,
     pattern: Collection[int],
     progress: bool = False,
+    classes: list[frozenset[User]] | None = None,
+    lazy: bool = False,
+    strategy: Strategy = Strategy.qi,
 ) -> AnonymizedData:
-    interaction_graph = extract_interaction_graph_from_overlay(data)
-    classes = divide_nodes(interaction_graph, m, ordering_function, progress=progress)
-    assert check_anonymized(interaction_graph, classes)
+    if classes is None:
+        classes = compute_classes(data, m, progress, strategy)
     match operation:
         case Operation.uniform_list:
-            return anonymize_uniform_list(data, classes, pattern)
+            return anonymize_uniform_list(data, classes, pattern, lazy)
         case Operation.partitioning:
             return anonymize_partitioning(data, classes)
 
 
 def anonymize_uniform_list(
-    data: Data, classes: list[frozenset[User]], pattern: Collection[int]
+    data: Data,
+    classes: list[frozenset[User]],
+    pattern: Collection[int],
+    lazy: bool = False,
 ) -> AnonymizedData:
+    # Lazy graphs are views over the graphs of data, enough to dump or draw them
     mapping = generate_uniform_lists(classes, pattern, ordering_function)
+    relabel = uniform_list_view if lazy else apply_uniform_lists
     new_graphs = {
-        name: apply_uniform_lists(graph, mapping)
-        for name, graph in data.all_graphs().items()
+        name: relabel(graph, mapping) for name, graph in data.all_graphs().items()
     }
     return AnonymizedData.from_graphs_list(data.users, [*mapping.values()], new_graphs)
 
@@ -244,14 +531,79 @@ def partition_graph[
     return result
 
 
-@app.command()
-def main(operation: Operation, input: str, output: str, m: int = 10, k: int = 10):
-    data = Data.load(input)
-    new_data = anonymize_data(
-        data, operation, m=m, pattern=prefix_pattern(k), progress=True
+def manifest_file(output: str) -> Path:
+    return Path(f"{output}.manifest.json")
+
+
+def dump_output(overlay: GraphOverlay[Any], output: str, verify: bool):
+    # Verifying hashes the written file against the text that was serialized,
+    # and keeps the manifest next to it, instead of loading the output again
+    manifest = overlay.dump(output)
+    if verify:
+        manifest_file(output).write_text(manifest.model_dump_json())
+        manifest.check(output)
+
+
+def anonymize_file(
+    operation: Operation,
+    input: str,
+    output: str,
+    m: int,
+    k: int,
+    cache_dir: Path | None = None,
+    progress: bool = False,
+    verify: bool = False,
+    strategy: Strategy = Strategy.qi,
+):
+    pattern = prefix_pattern(k)
+    if cache_dir is None:
+        data = Data.load(input, lazy=True)
+        new_data = anonymize_data(
+            data, operation, m, pattern, progress, lazy=True, strategy=strategy
+        )
+        dump_output(new_data, output, verify)
+        return
+    cache = ResultCache(cache_dir)
+    digest = digest_file(Path(input))
+    # The partitioning output does not depend on the pattern
+    key = cache_key(
+        digest,
+        operation,
+        m,
+        [*pattern] if operation == Operation.uniform_list else [],
+        strategy,
     )
-    new_data.dump(output)
-    AnonymizedData.load(output)
+    if cache.restore(key, ".json", Path(output)):
+        if not verify:
+            return
+        # Entries written without verification have no manifest, and are
+        # computed again
+        if cache.restore(key, ".manifest.json", manifest_file(output)):
+            manifest = Manifest.model_validate_json(manifest_file(output).read_text())
+            manifest.check(output)
+            return
+    data = Data.load(input, lazy=True)
+    classes = cached_classes(data, m, cache, digest, progress, strategy)
+    new_data = anonymize_data(data, operation, m, pattern, classes=classes, lazy=True)
+    dump_output(new_data, output, verify)
+    cache.put_file(key, ".json", Path(output))
+    if verify:
+        cache.put_file(key, ".manifest.json", manifest_file(output))
+
+
+@app.command()
+@profiled
+def main(
+    operation: Operation,
+    input: str,
+    output: str,
+    m: int = 10,
+    k: int = 10,
+    cache_dir: Optional[Path] = None,
+    verify: bool = False,
+    strategy: Strategy = Strategy.qi,
+):
+    anonymize_file(operation, input, output, m, k, cache_dir, True, verify, strategy)
 
 
 if __name__ == "__main__":
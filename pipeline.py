@@ -0,0 +1,77 @@
+from __future__ import annotations
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+import sys
+from time import perf_counter
+from typing import Optional
+from typer import Typer
+
+from data import Data
+from generator import Scale, generate_data, preset
+from paper import Operation, Strategy, anonymize_data, dump_output, prefix_pattern
+from profiling import memory_stage, profiled
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = perf_counter()
+    with memory_stage(name):
+        yield
+    print(f"{name}: {perf_counter() - start:.2f}s", file=sys.stderr)
+
+
+app = Typer(pretty_exceptions_enable=False)
+
+
+@app.command()
+@profiled
+def main(
+    input: Optional[Path] = None,
+    n: int = 10**4,
+    seed: int = 42,
+    scale: Optional[Scale] = None,
+    relation: list[str] = [],
+    operation: Operation = Operation.uniform_list,
+    m: int = 10,
+    k: int = 10,
+    strategy: Strategy = Strategy.qi,
+    generalization_k: int = 2,
+    data: Optional[Path] = None,
+    anonymized: Optional[Path] = None,
+    generalized: Optional[str] = None,
+    verify: bool = False,
+):
+    # The stages share the data in memory, each intermediate is only written
+    # when a path is given for it
+    from scripts import generalization
+
+    with stage("generate" if input is None else "load"):
+        if input is None:
+            n, relations = preset(n, scale, relation)
+            dataset = generate_data(n, seed, progress=False, relations=relations)
+        else:
+            dataset = Data.load(str(input), lazy=True)
+        if data is not None:
+            dump_output(dataset, str(data), verify)
+    with stage("anonymize"):
+        new_data = anonymize_data(
+            dataset, operation, m, prefix_pattern(k), lazy=True, strategy=strategy
+        )
+        if anonymized is not None:
+            dump_output(new_data, str(anonymized), verify)
+    with stage("generalize"):
+        frame = generalization.anonymize_data(
+            generalization.preprocessing(dataset), seed, generalization_k
+        )
+        if generalized is not None:
+            generalization.write_frames([frame], generalized)
+    print(
+        f"{len(dataset.users)} users, {len(new_data.classes)} classes,"
+        f" {len(frame)} generalized rows",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    app()
@@ -1,45 +1,254 @@
-from typer import Typer
+from __future__ import annotations
+from collections import Counter, deque
+from collections.abc import Mapping
+from hashlib import sha256
+from heapq import nlargest
+from typer import BadParameter, Typer
 from pathlib import Path
-from networkx import Graph, draw, spring_layout, closeness_centrality
+import sys
+from networkx import (
+    DiGraph,
+    Graph,
+    draw,
+    spring_layout,
+    closeness_centrality,
+    single_source_shortest_path_length,
+)
 from tempfile import NamedTemporaryFile
-from matplotlib.pyplot import savefig, show
 from subprocess import run
+import numpy as np
+from numpy.typing import NDArray
 from data import Data
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 from paper import AnonymizedData
+from profiling import profiled
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
 
 app = Typer()
 
+type Layout = dict[Any, NDArray[np.float64]]
+
+
+def sampled_layout(graph: Graph[Any], k: float, seed: int, sample: int) -> Layout:
+    if len(graph) <= sample:
+        return spring_layout(graph, k=k, seed=seed)
+    # Only the best connected nodes go through the force-directed layout,
+    # every other node is placed at the barycentre of its placed neighbours
+    pivots = nlargest(sample, graph, key=graph.degree)
+    pos: Layout = spring_layout(graph.subgraph(pivots), k=k, seed=seed)
+    undirected = graph.to_undirected(as_view=True)
+    rng = np.random.default_rng(seed)
+    queue = deque(pivots)
+    while queue:
+        u = queue.popleft()
+        for v in undirected[u]:
+            if v in pos:
+                continue
+            placed = [pos[w] for w in undirected[v] if w in pos]
+            pos[v] = np.mean(placed, axis=0) + rng.normal(0, k * 0.1, 2)
+            queue.append(v)
+    for u in graph:
+        if u not in pos:
+            pos[u] = rng.uniform(-1, 1, 2)
+    return pos
+
+
+def approximate_closeness(
+    graph: Graph[Any], pivots: int, seed: int
+) -> dict[Any, float]:
+    # Eppstein-Wang estimate over the incoming distance, like closeness_centrality
+    nodes = [*graph]
+    index = {u: i for i, u in enumerate(nodes)}
+    rng = np.random.default_rng(seed)
+    sources = rng.choice(len(nodes), size=min(pivots, len(nodes)), replace=False)
+    totals = np.zeros(len(nodes))
+    reached = np.zeros(len(nodes))
+    for source in sources:
+        for v, d in single_source_shortest_path_length(graph, nodes[source]).items():
+            totals[index[v]] += d
+            reached[index[v]] += d > 0
+    is_source = np.zeros(len(nodes), dtype=bool)
+    is_source[sources] = True
+    candidates = len(sources) - is_source
+    with np.errstate(divide="ignore", invalid="ignore"):
+        closeness = np.where(totals > 0, reached / candidates * reached / totals, 0.0)
+    return dict(zip(nodes, closeness.tolist()))
+
+
+def layout_cache_file(cache: Path, digest: str, seed: int, k: float, mode: str):
+    return cache / f"{digest}-{seed}-{k}-{mode}.npy"
+
+
+def cached_layout(
+    graph: Graph[Any],
+    cache: Path | None,
+    digest: str,
+    seed: int,
+    k: float,
+    sample: int | None,
+    mode: str = "sampled",
+) -> Layout:
+    mode = "full" if sample is None else f"{mode}{sample}"
+    file = None if cache is None else layout_cache_file(cache, digest, seed, k, mode)
+    if file is not None and file.exists():
+        return dict(zip(graph, np.load(file)))
+    if sample is None:
+        pos: Layout = spring_layout(graph, k=k, seed=seed)
+    else:
+        pos = sampled_layout(graph, k, seed, sample)
+    if file is not None:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        np.save(file, np.array([pos[u] for u in graph]).reshape(-1, 2))
+    return pos
+
+
+def draw_large(
+    graph: Graph[Any],
+    pos: Layout,
+    centrality: list[float],
+    ax: Axes,
+    node_size: float | list[float] = 1,
+    edge_width: float | list[float] = 0.1,
+):
+    from matplotlib.collections import LineCollection
+
+    segments = np.array([(pos[u], pos[v]) for u, v in graph.edges()]).reshape(-1, 2, 2)
+    ax.add_collection(
+        LineCollection(
+            segments,
+            colors=[(0.1, 0.5, 0.8, 0.3)],
+            linewidths=edge_width,
+            rasterized=True,
+        )
+    )
+    xy = np.array([pos[u] for u in graph]).reshape(-1, 2)
+    ax.scatter(
+        xy[:, 0], xy[:, 1], s=node_size, c=centrality, linewidths=0, rasterized=True
+    )
+    ax.autoscale()
+    ax.set_axis_off()
+
+
+def quotient_graph(
+    graph: Graph[Any], class_of: Mapping[Any, Any] | None = None
+) -> DiGraph[Any]:
+    # Parallel class edges collapse into one edge weighted by their multiplicity.
+    # A loaded anonymized graph has lost its parallel edges, so they are counted
+    # on the original graph instead when class_of maps its nodes to the classes
+    result: DiGraph[Any] = DiGraph()
+    if class_of is None:
+        result.add_nodes_from(graph)
+        result.add_weighted_edges_from(
+            (u, v, len(keys) if graph.is_multigraph() else 1)
+            for u, neighbours in graph.adjacency()
+            for v, keys in neighbours.items()
+        )
+        return result
+    result.add_nodes_from(sorted({*class_of.values()}))
+    weights = Counter((class_of[u], class_of[v]) for u, v in graph.edges())
+    result.add_weighted_edges_from((u, v, w) for (u, v), w in weights.items())
+    return result
+
+
+def draw_quotient(
+    data: AnonymizedData,
+    original: Data | None,
+    ax: Axes,
+    layout_cache: Path | None,
+    digest: str,
+    seed: int,
+    k: float,
+    sample: int,
+    pivots: int,
+):
+    if original is None:
+        quotient = quotient_graph(data.following)
+    else:
+        classes = {u.username: c for c in data.classes for u in c.nodes}
+        # The uniform lists of a user overlap, so only a partition tells which
+        # class an original edge went to
+        if len(classes) != sum(len(c.nodes) for c in data.classes):
+            raise BadParameter(
+                "--original needs a partitioning output, uniform lists overlap"
+            )
+        quotient = quotient_graph(
+            original.following, {u: classes[u.username] for u in original.following}
+        )
+    sizes = {c: len(c.nodes) for c in data.classes}
+    weights = np.array([w for _, _, w in quotient.edges(data="weight")], dtype=float)
+    pos = cached_layout(quotient, layout_cache, digest, seed, k, sample, "quotient")
+    centrality = [*approximate_closeness(quotient, pivots, seed).values()]
+    draw_large(
+        quotient,
+        pos,
+        centrality,
+        ax,
+        node_size=[sizes.get(c, 1) for c in quotient],
+        edge_width=(0.1 * weights).tolist(),
+    )
+
 
 @app.command()
+@profiled
 def main(
     input: Path,
     out: Optional[str] = None,
     seed: int = 42,
     k: float = 1,
     anonymized: bool = False,
+    large: bool = False,
+    sample: int = 400,
+    pivots: int = 100,
+    layout_cache: Optional[Path] = None,
+    quotient: bool = False,
+    original: Optional[Path] = None,
 ):
-    model = AnonymizedData if anonymized else Data
-    data = model.model_validate_json(input.read_text())
+    # matplotlib is only imported once there is something to draw
+    from matplotlib.pyplot import gca, savefig, show
+
+    model = AnonymizedData if anonymized or quotient else Data
+    raw = input.read_bytes()
+    data = model.model_validate_json(raw.decode())
     graph: Graph[Any] = data.following
-    pos = spring_layout(graph, k=k, seed=seed)
-    centrality = [*closeness_centrality(graph).values()]
-    draw(
-        graph,
-        pos,
-        node_size=10,
-        node_color=centrality,
-        edge_color=(0.1, 0.5, 0.8, 0.3),
-        linewidths=0.01,
-        margins=(0, 0),
-        arrowsize=3,
-    )
+    digest = sha256(raw).hexdigest()
+    if quotient:
+        assert isinstance(data, AnonymizedData)
+        # The edge widths come from the graph the anonymized one was made from
+        source = None
+        if original is not None:
+            source_raw = original.read_bytes()
+            source = Data.model_validate_json(source_raw.decode())
+            digest = sha256(raw + source_raw).hexdigest()
+        elif not data.following.is_multigraph():
+            print("edge multiplicities need --original", file=sys.stderr)
+        draw_quotient(
+            data, source, gca(), layout_cache, digest, seed, k, sample, pivots
+        )
+    elif large:
+        pos = cached_layout(graph, layout_cache, digest, seed, k, sample)
+        centrality = [*approximate_closeness(graph, pivots, seed).values()]
+        draw_large(graph, pos, centrality, gca())
+    else:
+        pos = cached_layout(graph, layout_cache, digest, seed, k, None)
+        centrality = [*closeness_centrality(graph).values()]
+        draw(
+            graph,
+            pos,
+            node_size=10,
+            node_color=centrality,
+            edge_color=(0.1, 0.5, 0.8, 0.3),
+            linewidths=0.01,
+            margins=(0, 0),
+            arrowsize=3,
+        )
     try:
         if out is None:
             with NamedTemporaryFile(delete=False, suffix=".svg") as tmp:
                 out = tmp.name
-        savefig(out)
+        savefig(out, dpi=300 if large or quotient else "figure")
         run(["xdg-open", out])
     except FileNotFoundError:
         show()
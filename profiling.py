@@ -0,0 +1,170 @@
+from __future__ import annotations
+from collections import Counter
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+from inspect import Parameter, signature
+from pathlib import Path
+import sys
+from threading import Event, Thread, get_ident
+from types import FrameType
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from tracemalloc import Snapshot
+
+# Memory stages of the run by name: how many times it ran, the highest peak in
+# bytes and the snapshot at the end of its last run. Stages repeated thousands
+# of times, like loading every overlay of a batch, keep a single snapshot
+STAGES: dict[str, tuple[int, int, Snapshot]] = {}
+# Peaks of the memory stages being run, innermost last
+PEAKS: list[int] = []
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class Sampler(Thread):
+    # Samples the stack of a thread every interval seconds, up to the root frame
+    def __init__(self, thread: int, root: FrameType, interval: float):
+        super().__init__(daemon=True)
+        self.thread = thread
+        self.root = root
+        self.interval = interval
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread)
+            stack: list[str] = []
+            while frame is not None and frame is not self.root:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[(*reversed(stack),)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+@contextmanager
+def memory_stage(name: str) -> Iterator[None]:
+    # Keeps a snapshot of the allocations alive at the end of the stage and the
+    # peak reached during it, only when the memory is being profiled
+    tracemalloc = sys.modules.get("tracemalloc")
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        yield
+        return
+    if PEAKS:
+        PEAKS[-1] = max(PEAKS[-1], tracemalloc.get_traced_memory()[1])
+    PEAKS.append(0)
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        peak = max(PEAKS.pop(), tracemalloc.get_traced_memory()[1])
+        if PEAKS:
+            PEAKS[-1] = max(PEAKS[-1], peak)
+        runs, highest, _ = STAGES.get(name, (0, 0, None))
+        STAGES[name] = runs + 1, max(highest, peak), tracemalloc.take_snapshot()
+
+
+def write_collapsed(stacks: Counter[tuple[str, ...]], file: Path):
+    # One "frame;frame;frame samples" line per stack, as read by flamegraph.pl
+    # and speedscope
+    with open(file, "wt") as f:
+        for stack, samples in stacks.most_common():
+            f.write(f"{';'.join(stack)} {samples}\n")
+
+
+def print_hotspots(stacks: Counter[tuple[str, ...]], interval: float, top: int):
+    samples = stacks.total()
+    own: Counter[str] = Counter()
+    total: Counter[str] = Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for name in {*stack}:
+            total[name] += count
+    print(
+        f"{samples} samples every {interval * 1000:g}ms\n{'self':>6} {'total':>6}",
+        file=sys.stderr,
+    )
+    for name, _ in total.most_common(top):
+        print(
+            f"{own[name] / samples:>6.1%} {total[name] / samples:>6.1%} {name}",
+            file=sys.stderr,
+        )
+
+
+def print_memory(output: Path | None, top: int):
+    # The snapshots are only written next to a --profile file
+    for i, (name, (runs, peak, snapshot)) in enumerate(STAGES.items()):
+        size = sum(stat.size for stat in snapshot.statistics("filename"))
+        print(
+            f"{name}: {runs} runs, peak {peak / 2**20:.1f}MiB,"
+            f" {size / 2**20:.1f}MiB alive",
+            file=sys.stderr,
+        )
+        if output is not None:
+            snapshot.dump(f"{output}.{i}.{name}.tracemalloc")
+    if STAGES:
+        _, _, snapshot = [*STAGES.values()][-1]
+        for stat in snapshot.statistics("lineno")[:top]:
+            print(stat, file=sys.stderr)
+
+
+def profiled[R](command: Callable[..., R]) -> Callable[..., R]:
+    # Adds the profiling options to a Typer command. The stacks of the command
+    # are written in the collapsed format to --profile and the hotspots are
+    # printed, --profile-memory traces the allocations of every memory stage.
+    # Worker processes are not sampled
+    @wraps(command)
+    def wrapper(
+        *args: Any,
+        profile: Optional[Path] = None,
+        profile_memory: bool = False,
+        profile_interval: float = 0.005,
+        profile_top: int = 20,
+        **kwargs: Any,
+    ) -> R:
+        if profile is None and not profile_memory:
+            return command(*args, **kwargs)
+        sampler = None
+        if profile is not None:
+            sampler = Sampler(get_ident(), sys._getframe(), profile_interval)
+            sampler.start()
+        if profile_memory:
+            import tracemalloc
+
+            STAGES.clear()
+            tracemalloc.start()
+        try:
+            with memory_stage(command.__name__):
+                return command(*args, **kwargs)
+        finally:
+            if sampler is not None:
+                sampler.stop()
+                write_collapsed(sampler.stacks, profile)
+                print_hotspots(sampler.stacks, profile_interval, profile_top)
+            if profile_memory:
+                tracemalloc.stop()
+                print_memory(profile, profile_top)
+
+    parameters = [
+        Parameter(name, Parameter.KEYWORD_ONLY, default=default, annotation=annotation)
+        for name, annotation, default in [
+            ("profile", Optional[Path], None),
+            ("profile_memory", bool, False),
+            ("profile_interval", float, 0.005),
+            ("profile_top", int, 20),
+        ]
+    ]
+    command_signature = signature(command)
+    wrapper.__signature__ = command_signature.replace(  # type: ignore
+        parameters=[*command_signature.parameters.values(), *parameters]
+    )
+    return wrapper
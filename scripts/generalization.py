@@ -1,16 +1,28 @@
 from __future__ import annotations
 from collections import Counter
-import random
-from pandas import DataFrame
-
-from collections.abc import Callable
-from typing import Any
-from random import randint
-from datetime import date
-from typer import Typer
+from pandas import DataFrame, RangeIndex, Series
+
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from itertools import batched
+from typing import Any, Optional
+from datetime import date, datetime
+from typer import BadParameter, Typer
 from pathlib import Path
-from data import Data, Gender
+import sys
+from numpy.typing import NDArray
+import numpy as np
+from cache import ResultCache, cache_key, digest_file
+from data import Data, Gender, User, UserTable, iter_field
 from faker import Faker
+from scripts.lattice import ParallelEvaluator, encode, incognito
+from scripts.perturbation import (
+    Distribution,
+    Perturbation,
+    UniformNoise,
+    column_key,
+)
+from scripts.pseudonyms import PseudonymTable, load_table, table_file
+from profiling import profiled
 
 
 type Generalization[T] = Callable[[T, int], T]
@@ -65,6 +77,9 @@ def generalize_phone_number(a: str, step: int):
 
 
 def generalize_birth_date(b: date, step: int):
+    # Columnar frames hold birth dates as datetime64, whose scalars are datetimes
+    if isinstance(b, datetime):
+        b = b.date()
     if step >= 1:
         b = b.replace(day=1)
     if step >= 2:
@@ -74,19 +89,15 @@ def generalize_birth_date(b: date, step: int):
     return b
 
 
-def substitute(v: list[str], f: Callable[[Faker], str], seed: int) -> list[str]:
-    unique = {*v}
-    faker = Faker(seed=seed)
-    map: dict[str, str] = {u: f(faker) for u in unique}
-    return [map[u] for u in v]
-
-
-def perturbate[T](v: T, f: Callable[[T], T]) -> T:
-    return f(v)
-
-
-def perturbate_followers(v: int) -> int:
-    return max(v + randint(-10, 10), 0)
+def substitute(
+    v: Iterable[str],
+    f: Callable[[Faker], str],
+    seed: int,
+    table: PseudonymTable | None = None,
+) -> NDArray[np.object_]:
+    if table is None:
+        table = PseudonymTable()
+    return table.substitute(v, f, seed)
 
 
 EI: dict[str, Callable[[Faker], str]] = {
@@ -103,28 +114,146 @@ QI = {
     "city": (generalize_city, 1),
     "phone_number": (generalize_phone_number, 5),
 }
-SD = {"followers": perturbate_followers}
+SD = {"followers": Perturbation(UniformNoise(-10, 10), minimum=0)}
+# Number of generalization steps after which a QI conveys no more information
+HEIGHTS = {
+    "birth_date": 3,
+    "gender": 1,
+    "cap": 5,
+    "address": 2,
+    "city": 2,
+    "phone_number": 10,
+}
+HIERARCHIES = {qi: (f, HEIGHTS[qi]) for qi, (f, _) in QI.items()}
+MAX_BYTES = 2**30
+
+
+COLUMNS: dict[str, str] = {
+    "gender": "category",
+    "city": "category",
+    "birth_date": "datetime64[s]",
+    "cap": "int32",
+}
+
+
+def user_columns(users: Sequence[User]) -> dict[str, list[Any]]:
+    return {field: [getattr(u, field) for u in users] for field in User.model_fields}
+
+
+def columns_frame(
+    columns: Mapping[str, Sequence[Any]], followers: Sequence[int]
+) -> DataFrame[str, int, Any]:
+    df: DataFrame[str, int, Any] = DataFrame(
+        {
+            field: Series(
+                to_datetime64(values)
+                if COLUMNS.get(field, "").startswith("datetime64")
+                else values,
+                dtype=COLUMNS.get(field),
+            )
+            for field, values in columns.items()
+        }
+    )
+    df["followers"] = np.asarray(followers, dtype=np.int64)
+    return df
+
+
+def to_datetime64(values: Sequence[Any]) -> NDArray[np.datetime64]:
+    if isinstance(values, np.ndarray):
+        return values.astype("datetime64[D]")
+    # Going through the ordinals is much faster than numpy parsing date objects
+    ordinals = np.fromiter((d.toordinal() for d in values), np.int64, len(values))
+    return (ordinals - date(1970, 1, 1).toordinal()).astype("datetime64[D]")
 
 
 def preprocessing(data: Data) -> DataFrame[str, int, Any]:
     users = data.users
-    df: DataFrame[str, int, Any] = DataFrame([u.model_dump() for u in users])
-    df["followers"] = [data.following.in_degree(u) for u in users]
-    return df
+    followers = np.fromiter(
+        (d for _, d in data.following.in_degree(users)),
+        dtype=np.int64,
+        count=len(users),
+    )
+    return columns_frame(user_columns(users), followers)
+
+
+def record_columns(records: Sequence[dict[str, Any]]) -> dict[str, Any]:
+    # Validated as strictly as the users of a whole dataset
+    return UserTable.from_records(records).columns
+
+
+def stream_preprocessing(
+    input: Path, chunk_size: int
+) -> Iterator[DataFrame[str, int, Any]]:
+    followers = Counter(
+        v for _, neighbours in iter_field(input, "following") for v in neighbours
+    )
+    start = 0
+    for records in batched(iter_field(input, "users"), chunk_size):
+        columns = record_columns(records)
+        frame = columns_frame(columns, [followers[u] for u in columns["username"]])
+        # Rows keep their position in the dataset, which keys their noise
+        frame.index = RangeIndex(start, start + len(frame))
+        start += len(frame)
+        yield frame
+
+
+def load_tables(pseudonyms: Path | None, seed: int) -> dict[str, PseudonymTable]:
+    return {ei: load_table(pseudonyms, ei, seed) for ei in EI}
+
+
+def save_tables(tables: Mapping[str, PseudonymTable], pseudonyms: Path, seed: int):
+    for ei, table in tables.items():
+        table.save(table_file(pseudonyms, ei, seed))
 
 
 def anonymize_data(
-    data: DataFrame[str, int, Any], seed: int, k: int
+    data: DataFrame[str, int, Any],
+    seed: int,
+    k: int,
+    pseudonyms: Path | None = None,
+    sd: Mapping[str, Perturbation] = SD,
+    steps: Mapping[str, int] | None = None,
+) -> DataFrame[str, int, Any]:
+    tables = load_tables(pseudonyms, seed)
+    data = anonymize_chunk(data, seed, tables, sd, steps)
+    if pseudonyms is not None:
+        save_tables(tables, pseudonyms, seed)
+    return data
+
+
+def anonymize_stream(
+    data: Iterable[DataFrame[str, int, Any]],
+    seed: int,
+    pseudonyms: Path | None = None,
+    sd: Mapping[str, Perturbation] = SD,
+) -> Iterator[DataFrame[str, int, Any]]:
+    # Every transformation but Datafly is row-local, so chunks can be anonymized
+    # one at a time as long as they share the pseudonym tables
+    tables = load_tables(pseudonyms, seed)
+    for chunk in data:
+        yield anonymize_chunk(chunk, seed, tables, sd)
+    if pseudonyms is not None:
+        save_tables(tables, pseudonyms, seed)
+
+
+def anonymize_chunk(
+    data: DataFrame[str, int, Any],
+    seed: int,
+    tables: Mapping[str, PseudonymTable],
+    sd: Mapping[str, Perturbation] = SD,
+    steps: Mapping[str, int] | None = None,
 ) -> DataFrame[str, int, Any]:
-    random.seed(seed)
     data = data.copy()
     for ei, f in EI.items():
-        data[ei] = substitute([*data[ei]], f, seed)
+        data[ei] = substitute(data[ei], f, seed, tables[ei])
     # data[[*QI]] = datafly(data, k)
-    for qi, (f, steps) in QI.items():
-        data[qi] = data[qi].apply(lambda v: generalize(v, f, steps))
-    for sd, f in SD.items():
-        data[sd] = data[sd].apply(lambda v: perturbate(v, f))
+    for qi, (f, default) in QI.items():
+        step = default if steps is None else steps[qi]
+        data[qi] = data[qi].apply(lambda v: generalize(v, f, step))
+    for column, perturbation in sd.items():
+        data[column] = perturbation.apply(
+            data[column].to_numpy(), data.index.to_numpy(), column_key(seed, column)
+        )
     return data
 
 
@@ -151,13 +280,114 @@ def datafly(data: DataFrame[str, int, Any], k: int):
     return data
 
 
+def write_frames(frames: Iterable[DataFrame[str, int, Any]], output: str):
+    if output.endswith(".parquet"):
+        write_parquet(frames, output)
+        return
+    with open(output, "wt", newline="") as f:
+        for i, frame in enumerate(frames):
+            frame.to_csv(f, header=i == 0, index=False)
+
+
+def write_parquet(frames: Iterable[DataFrame[str, int, Any]], output: str):
+    try:
+        from pyarrow import Table
+        from pyarrow.parquet import ParquetWriter
+    except ImportError as e:
+        raise BadParameter(
+            "writing Parquet needs pyarrow, install the parquet extra"
+        ) from e
+
+    writer: ParquetWriter | None = None
+    try:
+        for frame in frames:
+            table = Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = ParquetWriter(output, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def full_domain(
+    data: DataFrame[str, int, Any], k: int, max_suppressed: int = 0, workers: int = 1
+) -> tuple[DataFrame[str, int, Any], dict[str, int]]:
+    table = encode(data, HIERARCHIES)
+    if workers > 1:
+        with ParallelEvaluator(table, k, workers, MAX_BYTES) as evaluator:
+            result = incognito(table, k, max_suppressed, MAX_BYTES, evaluator)
+    else:
+        result = incognito(table, k, max_suppressed, MAX_BYTES)
+    if result is None:
+        raise ValueError(f"no generalization is {k}-anonymous")
+    suppressed = table.small_groups(tuple(result.levels.values()), k)
+    return data[~suppressed], result.levels
+
+
+def tables_digest(pseudonyms: Path | None, seed: int) -> list[str | None]:
+    if pseudonyms is None:
+        return []
+    files = [table_file(pseudonyms, ei, seed) for ei in EI]
+    return [digest_file(f) if f.exists() else None for f in files]
+
+
 app = Typer(pretty_exceptions_enable=False)
 
 
 @app.command()
-def main(input: Path, output: str, seed: int = 42, k: int = 2):
-    users = Data.model_validate_json(input.read_text())
-    anonymize_data(preprocessing(users), seed, k).to_csv(output, index=False)
+@profiled
+def main(
+    input: Path,
+    output: str,
+    seed: int = 42,
+    k: int = 2,
+    pseudonyms: Optional[Path] = None,
+    chunk_size: Optional[int] = None,
+    noise: Distribution = Distribution.uniform,
+    scale: float = 10,
+    optimal: bool = False,
+    max_suppressed: int = 0,
+    workers: int = 1,
+    cache_dir: Optional[Path] = None,
+):
+    sd = {column: Perturbation(noise.noise(scale), minimum=0) for column in SD}
+    if chunk_size is not None and optimal:
+        raise BadParameter("the optimal search needs the whole dataset")
+    if cache_dir is not None:
+        cache = ResultCache(cache_dir)
+        suffix = Path(output).suffix
+        # Chunking and workers do not change the output, existing pseudonym
+        # tables do. k and the suppression budget only matter to the optimal
+        # search
+        key = cache_key(
+            digest_file(input),
+            "generalization",
+            seed,
+            noise,
+            scale,
+            (k, max_suppressed) if optimal else None,
+            tables_digest(pseudonyms, seed),
+            suffix,
+        )
+        if cache.restore(key, suffix, Path(output)):
+            return
+    if chunk_size is not None:
+        chunks = stream_preprocessing(input, chunk_size)
+        write_frames(anonymize_stream(chunks, seed, pseudonyms, sd), output)
+    else:
+        users = Data.model_validate_json(input.read_text())
+        data, steps = preprocessing(users), None
+        if optimal:
+            rows = len(data)
+            data, steps = full_domain(data, k, max_suppressed, workers)
+            print(
+                f"levels {steps}, {rows - len(data)} rows suppressed",
+                file=sys.stderr,
+            )
+        write_frames([anonymize_data(data, seed, k, pseudonyms, sd, steps)], output)
+    if cache_dir is not None:
+        cache.put_file(key, suffix, Path(output))
 
 
 if __name__ == "__main__":
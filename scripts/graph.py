@@ -1,14 +1,19 @@
 #!/bin/python3
 from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
 from networkx import Graph
-from typing import Any
+from typing import Any, Optional
 from typer import Typer
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
+from numpy.typing import NDArray
 from tempfile import NamedTemporaryFile
 from subprocess import run
 from data import Data
 from traceback import print_exc
+from profiling import profiled
 
 
 def check_weak(G: Graph[Any], k: int, l: int):
@@ -20,6 +25,227 @@ def check_strong(G: Graph[Any], Gm: Graph[Any], k: int, l: int):
     return all(sum(len({*G[v]} & {*Gm[u]}) >= l for u in G if u != v) >= k for v in G)
 
 
+MERSENNE = 2**31 - 1
+# Hashes minhash holds at once
+MINHASH_BLOCK = 2**22
+
+
+@dataclass(frozen=True)
+class Screening[N]:
+    # Vertices with less than k partners among the candidate pairs, with the
+    # partners found. Partners are only counted on candidates, so the exact
+    # check fails on a subset of these vertices
+    at_risk: dict[N, int]
+    candidates: int
+    bands: int
+    rows: int
+
+
+def lsh_bands(permutations: int, threshold: float, false_negative_rate: float):
+    # The longest bands, so the fewest candidates, that still find a pair with
+    # Jaccard similarity threshold with probability 1 - false_negative_rate
+    for rows in range(permutations, 0, -1):
+        bands = permutations // rows
+        if (1 - threshold**rows) ** bands <= false_negative_rate:
+            return bands, rows
+    return permutations, 1
+
+
+def minhash(
+    neighbourhoods: list[list[int]],
+    permutations: int,
+    seed: int,
+    block: int = MINHASH_BLOCK,
+) -> NDArray[np.int64]:
+    # (vertices, permutations) minimum of a universal hash of the neighbours,
+    # every neighbourhood must be non empty. The hashes are built and reduced
+    # about block at a time, over ranges of permutations and vertices
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE, permutations)
+    b = rng.integers(0, MERSENNE, permutations)
+    indices = np.fromiter((u for n in neighbourhoods for u in n), np.int64)
+    indptr = np.cumsum([0, *map(len, neighbourhoods)])
+    result = np.empty((len(neighbourhoods), permutations), np.int64)
+    columns = max(1, min(permutations, block // len(indices)))
+    start = 0
+    while start < len(neighbourhoods):
+        # At least one vertex, however large its neighbourhood
+        limit = indptr[start] + max(1, block // columns)
+        end = max(start + 1, int(np.searchsorted(indptr, limit, "right")) - 1)
+        segment = indices[indptr[start] : indptr[end]]
+        starts = indptr[start:end] - indptr[start]
+        for first in range(0, permutations, columns):
+            last = first + columns
+            hashes = (segment[:, None] * a[first:last] + b[first:last]) % MERSENNE
+            result[start:end, first:last] = np.minimum.reduceat(hashes, starts, axis=0)
+        start = end
+    return result
+
+
+def candidate_pairs(
+    signatures: NDArray[np.int64], bands: int, rows: int, window: int
+) -> NDArray[np.int64]:
+    # Vertices sharing a band are paired with their next window vertices in
+    # the bucket only, so a bucket of hubs' leaves stays linear
+    pairs: list[NDArray[np.int64]] = [np.empty((0, 2), np.int64)]
+    for band in range(bands):
+        _, buckets = np.unique(
+            signatures[:, band * rows : (band + 1) * rows], axis=0, return_inverse=True
+        )
+        order = np.argsort(buckets.ravel(), kind="stable")
+        sorted_buckets = buckets.ravel()[order]
+        for offset in range(1, window + 1):
+            same = sorted_buckets[:-offset] == sorted_buckets[offset:]
+            pairs.append(np.stack([order[:-offset][same], order[offset:][same]], 1))
+    result = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(result, axis=0)
+
+
+def common_neighbours(
+    indptr: NDArray[np.int64],
+    indices: NDArray[np.int64],
+    pairs: NDArray[np.int64],
+    block: int = MINHASH_BLOCK,
+) -> NDArray[np.int64]:
+    # Common neighbours of every pair, given the sorted neighbours of every
+    # vertex in CSR form. The neighbours of the smaller side of a pair are
+    # looked up among the sorted edge keys row * n + column, about block
+    # neighbours at a time
+    n = len(indptr) - 1
+    degrees = np.diff(indptr)
+    keys = np.repeat(np.arange(n), degrees) * n + indices
+    swap = degrees[pairs[:, 0]] > degrees[pairs[:, 1]]
+    small = np.where(swap, pairs[:, 1], pairs[:, 0])
+    large = np.where(swap, pairs[:, 0], pairs[:, 1])
+    sizes = degrees[small]
+    ends = np.cumsum(sizes)
+    result = np.zeros(len(pairs), np.int64)
+    start = 0
+    while start < len(pairs):
+        # At least one pair, however large its neighbourhood
+        limit = ends[start] - sizes[start] + block
+        end = max(start + 1, int(np.searchsorted(ends, limit, "right")))
+        size = sizes[start:end]
+        pair = np.repeat(np.arange(end - start), size)
+        offsets = np.arange(len(pair)) - np.repeat(np.cumsum(size) - size, size)
+        columns = indices[np.repeat(indptr[small[start:end]], size) + offsets]
+        queries = large[start:end][pair] * n + columns
+        positions = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+        found = keys[positions] == queries
+        result[start:end] = np.bincount(pair[found], minlength=end - start)
+        start = end
+    return result
+
+
+def screen_weak[
+    N
+](
+    G: Graph[N],
+    k: int,
+    l: int,
+    threshold: float = 0.5,
+    false_negative_rate: float = 0.05,
+    permutations: int = 128,
+    seed: int = 42,
+) -> Screening[N]:
+    # Approximate check_weak: MinHash signatures of the neighbourhoods and LSH
+    # banding give the pairs likely to overlap, only those are intersected.
+    # A vertex failing check_weak is always reported, a missed pair can only
+    # report a vertex that does not fail
+    nodes = [*G]
+    ids = {u: i for i, u in enumerate(nodes)}
+    neighbourhoods = [sorted(ids[v] for v in G[u]) for u in nodes]
+    indptr = np.cumsum([0, *map(len, neighbourhoods)])
+    indices = np.fromiter((v for n in neighbourhoods for v in n), np.int64)
+    # A vertex with less than l neighbours cannot overlap anyone by l
+    eligible = [i for i, n in enumerate(neighbourhoods) if len(n) >= max(l, 1)]
+    bands, rows = lsh_bands(permutations, threshold, false_negative_rate)
+    partners = np.zeros(len(nodes), np.int64)
+    candidates = 0
+    if eligible:
+        signatures = minhash([neighbourhoods[i] for i in eligible], bands * rows, seed)
+        pairs = np.asarray(eligible)[candidate_pairs(signatures, bands, rows, k)]
+        candidates = len(pairs)
+        overlapping = pairs[common_neighbours(indptr, indices, pairs) >= l]
+        partners = np.bincount(overlapping.ravel(), minlength=len(nodes))
+    return Screening(
+        {nodes[i]: int(p) for i, p in enumerate(partners) if p < k},
+        candidates,
+        bands,
+        rows,
+    )
+
+
+class OverlapTracker[N]:
+    # Keeps the weak (k,l)-anonymity of a live graph: the common neighbours of
+    # every pair sharing one and, per vertex, the partners sharing at least l.
+    # An edge (u,v) only changes the pairs of u with the neighbours of v and of
+    # v with the neighbours of u
+    def __init__(self, G: Graph[N], k: int, l: int):
+        if l < 1:
+            raise ValueError("l must be positive")
+        self.k = k
+        self.l = l
+        self.G: Graph[N] = Graph()
+        self.overlaps: dict[N, dict[N, int]] = {}
+        self.partners: dict[N, int] = {}
+        self.at_risk: set[N] = set()
+        for u in G:
+            self.add_node(u)
+        for u, v in G.edges():
+            self.add_edge(u, v)
+
+    def add_node(self, u: N):
+        if u in self.G:
+            return
+        self.G.add_node(u)
+        self.overlaps[u] = {}
+        self.partners[u] = 0
+        if self.k > 0:
+            self.at_risk.add(u)
+
+    def add_edge(self, u: N, v: N):
+        if self.G.has_edge(u, v):
+            return
+        self.add_node(u)
+        self.add_node(v)
+        self._shift(v, u, 1)
+        if u != v:
+            self._shift(u, v, 1)
+        self.G.add_edge(u, v)
+
+    def remove_edge(self, u: N, v: N):
+        self.G.remove_edge(u, v)
+        self._shift(v, u, -1)
+        if u != v:
+            self._shift(u, v, -1)
+
+    def is_anonymous(self) -> bool:
+        return not self.at_risk
+
+    def _shift(self, z: N, x: N, delta: int):
+        # z joins or leaves the neighbourhood of x, which then shares it with
+        # every other neighbour of z
+        for y in self.G[z]:
+            if y != x:
+                self._bump(x, y, delta)
+
+    def _bump(self, x: N, y: N, delta: int):
+        before = self.overlaps[x].get(y, 0)
+        after = before + delta
+        if after:
+            self.overlaps[x][y] = self.overlaps[y][x] = after
+        else:
+            del self.overlaps[x][y], self.overlaps[y][x]
+        if (before >= self.l) != (after >= self.l):
+            for w in (x, y):
+                self.partners[w] += delta
+                if self.partners[w] < self.k:
+                    self.at_risk.add(w)
+                else:
+                    self.at_risk.discard(w)
+
+
 # Function to implement Linear-time weak (2, 1)-anonymization
 def deficit_assignment[N](G: Graph[N]) -> dict[N, int]:
     unmarked = {u for u in G if G.degree(u) in [1, 2]}
@@ -252,7 +478,34 @@ app = Typer()
 
 
 @app.command()
-def main():
+@profiled
+def main(
+    input: Optional[Path] = None,
+    k: int = 2,
+    l: int = 1,
+    threshold: float = 0.5,
+    false_negative_rate: float = 0.05,
+):
+    if input is not None:
+        # Screens the interaction graph of a dataset instead of the example
+        from paper import extract_interaction_graph_from_overlay
+
+        data = Data.load(str(input), lazy=True)
+        screening = screen_weak(
+            extract_interaction_graph_from_overlay(data),
+            k,
+            l,
+            threshold,
+            false_negative_rate,
+        )
+        print(
+            f"{len(screening.at_risk)} vertices at risk of ({k},{l})-anonymity,"
+            f" {screening.candidates} candidate pairs"
+            f" ({screening.bands} bands of {screening.rows} rows)"
+        )
+        for u, partners in sorted(screening.at_risk.items(), key=lambda e: e[1]):
+            print(f"{getattr(u, 'username', u)}\t{partners}")
+        return
     G = Graph(
         {
             1: [2, 3],
@@ -290,6 +543,12 @@ def main():
         print(f"Gm is ({k},{1})-anonymous", weak)
         assert weak == (k < 5)
 
+    # The same check kept up to date while the edges are added
+    tracker = OverlapTracker(G, 4, 1)
+    tracker.add_edge(3, 10)
+    tracker.add_edge(10, 5)
+    assert tracker.is_anonymous()
+
     print()
     print("(4,1)-anonymous transformation of G")
     for k in range(1, 6):
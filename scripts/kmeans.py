@@ -2,14 +2,19 @@
 from __future__ import annotations
 import random
 import matplotlib.pyplot as plt
-from collections.abc import Sequence, Collection
-from typing import Protocol, Self
+import numpy as np
+from numpy.typing import NDArray
+from collections.abc import Callable, Iterable, Iterator, Sequence, Collection
+from itertools import batched
+from typing import Any, Optional, Protocol, Self
 from functools import reduce
 from pathlib import Path
+from networkx import DiGraph
 from data import Data
 from typer import Typer
 from dataclasses import dataclass
 from subprocess import run
+from profiling import profiled
 
 
 class Vector(Protocol):
@@ -37,29 +42,242 @@ def mean[T: Vector](p: Collection[T]) -> T | None:
     return result / len(p)
 
 
-def kmeans[T: Vector](points: Sequence[T], k: int):
-    centroids = random.sample(points, k=k)  # k centroidi
-    old_clusters: Sequence[int | None] = [None] * len(points)
+def to_array(points: Sequence[Vector]) -> NDArray[np.float64]:
+    return np.array(
+        [(p.x, p.y) if isinstance(p, Point) else (p,) for p in points], dtype=float
+    )
+
+
+def kmeans[T: Vector](points: Sequence[T], k: int) -> list[int]:
+    rng = np.random.default_rng(random.getrandbits(64))
+    clusters, _ = kmeans_array(to_array(points), k, rng)
+    return clusters.tolist()
+
+
+def kmeans_plusplus(
+    points: NDArray[np.float64], k: int, rng: np.random.Generator
+) -> NDArray[np.float64]:
+    centroids = np.empty((k, points.shape[1]))
+    centroids[0] = points[rng.integers(len(points))]
+    distances = squared_distances(points, centroids[:1]).ravel()
+    for i in range(1, k):
+        total = distances.sum()
+        # All the remaining points coincide with a centroid
+        if total == 0:
+            index = rng.integers(len(points))
+        else:
+            index = rng.choice(len(points), p=distances / total)
+        centroids[i] = points[index]
+        np.minimum(
+            distances,
+            squared_distances(points, centroids[i : i + 1]).ravel(),
+            out=distances,
+        )
+    return centroids
+
+
+def squared_distances(
+    points: NDArray[np.float64], centroids: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    return ((points[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+
+
+def assign(
+    points: NDArray[np.float64], centroids: NDArray[np.float64], chunk_size: int
+) -> tuple[NDArray[np.intp], float]:
+    # Chunked so that the (n, k) distance matrix never exceeds chunk_size * k
+    clusters = np.empty(len(points), dtype=np.intp)
+    inertia = 0.0
+    for start in range(0, len(points), chunk_size):
+        distances = squared_distances(points[start : start + chunk_size], centroids)
+        clusters[start : start + chunk_size] = distances.argmin(axis=1)
+        inertia += distances.min(axis=1).sum()
+    return clusters, inertia
+
+
+def update(
+    points: NDArray[np.float64],
+    clusters: NDArray[np.intp],
+    k: int,
+    rng: np.random.Generator,
+) -> NDArray[np.float64]:
+    sizes = np.bincount(clusters, minlength=k)
+    centroids = np.stack(
+        [
+            np.bincount(clusters, weights=points[:, d], minlength=k)
+            for d in range(points.shape[1])
+        ],
+        axis=1,
+    )
+    empty = sizes == 0
+    centroids[~empty] /= sizes[~empty, None]
+    # If a cluster is empty we insert a random point into it
+    centroids[empty] = points[rng.integers(len(points), size=empty.sum())]
+    return centroids
+
+
+def kmeans_array(
+    points: NDArray[np.float64],
+    k: int,
+    rng: np.random.Generator,
+    max_iter: int = 300,
+    tol: float = 1e-4,
+    log: bool = False,
+    chunk_size: int = 2**16,
+) -> tuple[NDArray[np.intp], NDArray[np.float64]]:
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 1:
+        points = points[:, None]
+    if log:
+        points = np.log1p(points)
+    centroids = kmeans_plusplus(points, k, rng)
+    clusters, _ = assign(points, centroids, chunk_size)
+    for _ in range(max_iter):
+        new_centroids = update(points, clusters, k, rng)
+        shift = ((new_centroids - centroids) ** 2).sum()
+        centroids = new_centroids
+        new_clusters, _ = assign(points, centroids, chunk_size)
+        converged = np.array_equal(new_clusters, clusters) or shift <= tol
+        clusters = new_clusters
+        if converged:
+            break
+    if log:
+        centroids = np.expm1(centroids)
+    return clusters, centroids
+
+
+@dataclass
+class MiniBatchKMeans:
+    centroids: NDArray[np.float64]
+    counts: NDArray[np.int64]
+    log: bool = False
+
+    @classmethod
+    def init(
+        cls, batch: NDArray[np.float64], k: int, rng: np.random.Generator, log: bool
+    ) -> Self:
+        centroids = kmeans_plusplus(transform(batch, log), k, rng)
+        return cls(centroids, np.zeros(k, dtype=np.int64), log)
+
+    @classmethod
+    def load(cls, file: Path) -> Self:
+        with np.load(file) as state:
+            return cls(state["centroids"], state["counts"], bool(state["log"]))
+
+    def save(self, file: Path):
+        with open(file, "wb") as f:
+            np.savez(f, centroids=self.centroids, counts=self.counts, log=self.log)
 
-    while True:
-        clusters = [
-            min(range(k), key=lambda x: abs(points[i] - centroids[x]))
-            for i in range(len(points))
-        ]
+    @property
+    def k(self) -> int:
+        return len(self.centroids)
 
-        # Per ogni singolo cluster, aggiorno il centroide
-        for i in range(k):
-            # array che contiene tutti i punti che hanno come cluster di appartenenza
-            # il cluster i-esimo
-            center = mean([points[j] for j in range(len(points)) if clusters[j] == i])
-            # If the cluster is empty we insert a random point into it
-            if center is None:
-                center = random.choice(points)
-            centroids[i] = center
+    def cluster_centers(self) -> NDArray[np.float64]:
+        return np.expm1(self.centroids) if self.log else self.centroids.copy()
 
-        if clusters == old_clusters:
-            return clusters
-        old_clusters = clusters
+    def predict(self, batch: NDArray[np.float64]) -> NDArray[np.intp]:
+        clusters, _ = assign(transform(batch, self.log), self.centroids, len(batch))
+        return clusters
+
+    def partial_fit(self, batch: NDArray[np.float64]) -> Self:
+        points = transform(batch, self.log)
+        clusters, _ = assign(points, self.centroids, len(points))
+        sizes = np.bincount(clusters, minlength=self.k)
+        sums = np.stack(
+            [
+                np.bincount(clusters, weights=points[:, d], minlength=self.k)
+                for d in range(points.shape[1])
+            ],
+            axis=1,
+        )
+        self.counts += sizes
+        # Per-centroid learning rate 1/count, so that every point seen so far
+        # weighs the same regardless of the batch it came in
+        updated = sizes > 0
+        self.centroids[updated] += (
+            sums[updated] - sizes[updated, None] * self.centroids[updated]
+        ) / self.counts[updated, None]
+        return self
+
+
+def transform(batch: NDArray[Any], log: bool) -> NDArray[np.float64]:
+    points = np.asarray(batch, dtype=float)
+    if points.ndim == 1:
+        points = points[:, None]
+    return np.log1p(points) if log else points
+
+
+def degree_chunks(
+    graph: DiGraph[Any], chunk_size: int
+) -> Iterator[NDArray[np.float64]]:
+    for nodes in batched(graph, chunk_size):
+        yield np.array(
+            [
+                (i, o)
+                for (_, i), (_, o) in zip(
+                    graph.in_degree(nodes), graph.out_degree(nodes)
+                )
+            ],
+            dtype=float,
+        )
+
+
+def dump_degrees(graph: DiGraph[Any], file: Path, chunk_size: int = 2**16):
+    dump = np.lib.format.open_memmap(
+        file, mode="w+", dtype=np.int64, shape=(len(graph), 2)
+    )
+    start = 0
+    for chunk in degree_chunks(graph, chunk_size):
+        dump[start : start + len(chunk)] = chunk
+        start += len(chunk)
+    dump.flush()
+
+
+def read_degree_chunks(file: Path, chunk_size: int) -> Iterator[NDArray[np.float64]]:
+    dump = np.load(file, mmap_mode="r")
+    for start in range(0, len(dump), chunk_size):
+        yield np.asarray(dump[start : start + chunk_size], dtype=float)
+
+
+def minibatch_kmeans(
+    chunks: Callable[[], Iterable[NDArray[np.float64]]],
+    k: int,
+    rng: np.random.Generator,
+    log: bool = False,
+    state: MiniBatchKMeans | None = None,
+    epochs: int = 1,
+) -> MiniBatchKMeans:
+    for _ in range(epochs):
+        for chunk in chunks():
+            if state is None:
+                state = MiniBatchKMeans.init(chunk, k, rng, log)
+            state.partial_fit(chunk)
+    assert state is not None
+    return state
+
+
+def reservoir_sample(
+    chunks: Iterable[NDArray[np.float64]], size: int, rng: np.random.Generator
+) -> NDArray[np.float64]:
+    # Uniform sample of at most size rows of the chunks, in constant memory
+    sample: NDArray[np.float64] | None = None
+    seen = 0
+    for chunk in chunks:
+        if sample is None:
+            sample = np.empty((0, chunk.shape[1]))
+        fill = chunk[: max(0, size - len(sample))]
+        sample = np.concatenate([sample, fill])
+        rest = chunk[len(fill) :]
+        # The i-th row after the first size replaces a random slot with
+        # probability size / (i + 1)
+        slots = rng.integers(0, seen + len(fill) + 1 + np.arange(len(rest)))
+        keep = slots < size
+        # Of the rows drawing the same slot, the last one stays
+        slots, rows = slots[keep][::-1], rest[keep][::-1]
+        slots, last = np.unique(slots, return_index=True)
+        sample[slots] = rows[last]
+        seen += len(chunk)
+    return np.empty((0, 2)) if sample is None else sample
 
 
 app = Typer()
@@ -84,16 +302,82 @@ class Point(Vector):
 
 
 @app.command()
-def main(input: Path, output: str, k: int = 3, seed: int = 42):
-    random.seed(seed)
+@profiled
+def main(
+    input: Path,
+    output: str,
+    k: int = 3,
+    seed: int = 42,
+    max_iter: int = 300,
+    tol: float = 1e-4,
+    log: bool = False,
+    batch_size: Optional[int] = None,
+    epochs: int = 1,
+    state: Optional[Path] = None,
+    dump: Optional[Path] = None,
+    plot_sample: int = 10**4,
+):
+    if batch_size is not None or input.suffix == ".npy":
+        return main_minibatch(
+            input,
+            output,
+            k,
+            seed,
+            log,
+            batch_size or 2**16,
+            epochs,
+            state,
+            dump,
+            plot_sample,
+        )
     data = Data.model_validate_json(input.read_text())
+    if dump is not None:
+        dump_degrees(data.following, dump)
     in_degree = data.following.in_degree()
     out_degree = data.following.out_degree()
-    degrees: list[Point] = [Point(in_degree[u], out_degree[u]) for u in data.following]
-    clusters = kmeans(degrees, k)
-    plt.scatter(
-        [d.x for d in degrees], [d.y for d in degrees], c=[c / k for c in clusters]
+    degrees = np.array(
+        [(in_degree[u], out_degree[u]) for u in data.following], dtype=float
+    )
+    clusters, _ = kmeans_array(
+        degrees, k, np.random.default_rng(seed), max_iter=max_iter, tol=tol, log=log
     )
+    plt.scatter(degrees[:, 0], degrees[:, 1], c=clusters / k)
+    show(output)
+
+
+def main_minibatch(
+    input: Path,
+    output: str,
+    k: int,
+    seed: int,
+    log: bool,
+    batch_size: int,
+    epochs: int,
+    state: Path | None,
+    dump: Path | None,
+    plot_sample: int,
+):
+    if input.suffix == ".npy":
+        chunks = lambda: read_degree_chunks(input, batch_size)
+    else:
+        graph = Data.model_validate_json(input.read_text()).following
+        if dump is not None:
+            dump_degrees(graph, dump)
+        chunks = lambda: degree_chunks(graph, batch_size)
+    # Refine the centroids of a previous run instead of starting from scratch
+    previous = MiniBatchKMeans.load(state) if state and state.exists() else None
+    model = minibatch_kmeans(
+        chunks, k, np.random.default_rng(seed), log, previous, epochs
+    )
+    if state is not None:
+        model.save(state)
+    # Only a sample is drawn, the chunks are never all in memory
+    sample = reservoir_sample(chunks(), plot_sample, np.random.default_rng(seed))
+    plt.scatter(sample[:, 0], sample[:, 1], c=model.predict(sample) / k, vmin=0, vmax=1)
+    show(output)
+
+
+def show(output: str):
     plt.yscale("log")
     plt.xscale("log")
     plt.savefig(output)
@@ -0,0 +1,322 @@
+from __future__ import annotations
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import batched, combinations, product
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+import numpy as np
+from numpy.typing import NDArray
+import pandas as pd
+from pandas import DataFrame
+
+type Levels = tuple[int, ...]
+type Columns = tuple[int, ...]
+type Codes = NDArray[np.int64]
+
+
+@dataclass
+class Hierarchy:
+    # ups[l] maps the codes of level l to the codes of level l + 1
+    ups: list[Codes]
+
+    @property
+    def height(self) -> int:
+        return len(self.ups)
+
+    def generalize(self, codes: Codes, start: int, stop: int) -> Codes:
+        for level in range(start, stop):
+            codes = self.ups[level][codes]
+        return codes
+
+
+def encode_hierarchy(
+    values: pd.Series[Any], generalization: Callable[[Any, int], Any], height: int
+) -> tuple[Codes, Hierarchy]:
+    codes, uniques = pd.factorize(values)
+    previous = np.arange(len(uniques))
+    ups: list[Codes] = []
+    for level in range(1, height + 1):
+        current, _ = pd.factorize(
+            np.array([generalization(u, level) for u in uniques], dtype=object)
+        )
+        up = np.zeros(previous.max(initial=-1) + 1, dtype=np.int64)
+        up[previous] = current
+        # Values equal at one level must stay equal at the next one
+        if not np.array_equal(up[previous], current):
+            raise ValueError(f"{values.name} is not a hierarchy at level {level}")
+        ups.append(up)
+        previous = current
+    return codes.astype(np.int64), Hierarchy(ups)
+
+
+@dataclass
+class CodedTable:
+    columns: list[str]
+    codes: Codes  # (rows, columns)
+    hierarchies: list[Hierarchy]
+
+    @property
+    def heights(self) -> Levels:
+        return tuple(h.height for h in self.hierarchies)
+
+    def generalize(self, columns: Columns, levels: Levels) -> Codes:
+        return np.stack(
+            [
+                self.hierarchies[c].generalize(self.codes[:, c], 0, level)
+                for c, level in zip(columns, levels)
+            ],
+            axis=1,
+        )
+
+    def small_groups(self, levels: Levels, k: int) -> NDArray[np.bool_]:
+        columns = tuple(range(len(self.columns)))
+        inverse, groups = group(self.generalize(columns, levels))
+        return np.bincount(inverse, minlength=groups)[inverse] < k
+
+
+def encode(
+    data: DataFrame[str, int, Any],
+    hierarchies: Mapping[str, tuple[Callable[[Any, int], Any], int]],
+) -> CodedTable:
+    columns: list[Codes] = []
+    encoded: list[Hierarchy] = []
+    for column, (generalization, height) in hierarchies.items():
+        codes, hierarchy = encode_hierarchy(data[column], generalization, height)
+        columns.append(codes)
+        encoded.append(hierarchy)
+    return CodedTable([*hierarchies], np.stack(columns, axis=1), encoded)
+
+
+def group(keys: Codes) -> tuple[NDArray[np.intp], int]:
+    # Mixed radix combination of the columns, refactorized after every column so
+    # that the combined key never exceeds the number of rows times a cardinality
+    combined = np.zeros(len(keys), dtype=np.int64)
+    groups = 1
+    for column in keys.T:
+        combined = combined * (column.max(initial=0) + 1) + column
+        combined, uniques = pd.factorize(combined)
+        combined = combined.astype(np.int64)
+        groups = len(uniques)
+    return combined, groups
+
+
+@dataclass
+class FrequencySet:
+    keys: Codes  # (groups, columns)
+    counts: NDArray[np.int64]
+
+    @classmethod
+    def from_codes(cls, keys: Codes) -> FrequencySet:
+        return cls(keys, np.ones(len(keys), dtype=np.int64)).regroup()
+
+    def regroup(self) -> FrequencySet:
+        inverse, groups = group(self.keys)
+        _, first = np.unique(inverse, return_index=True)
+        counts = np.bincount(inverse, weights=self.counts, minlength=groups)
+        return FrequencySet(self.keys[first], counts.astype(np.int64))
+
+    def rollup(self, column: int, up: Codes) -> FrequencySet:
+        keys = self.keys.copy()
+        keys[:, column] = up[keys[:, column]]
+        return FrequencySet(keys, self.counts).regroup()
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.counts.nbytes
+
+    def score(self, k: int) -> Score:
+        small = self.counts < k
+        return Score(
+            len(self.counts),
+            int(self.counts.min()) if len(self.counts) else 0,
+            int(self.counts[small].sum()),
+        )
+
+
+@dataclass(frozen=True)
+class Score:
+    groups: int
+    smallest: int
+    suppressed: int
+
+
+class FrequencyCache:
+    # Frequency sets of the lattice nodes of every subset of columns, bounded in
+    # bytes. A set is rolled up from a cached parent whenever there is one, and
+    # only computed from the rows otherwise
+    def __init__(self, table: CodedTable, max_bytes: int):
+        self.table = table
+        self.max_bytes = max_bytes
+        self.sets: dict[tuple[Columns, Levels], FrequencySet] = {}
+        self.size = 0
+
+    def __getitem__(self, key: tuple[Columns, Levels]) -> FrequencySet:
+        if key in self.sets:
+            return self.sets[key]
+        columns, node = key
+        for i, parent in parents_of(node):
+            if (columns, parent) in self.sets:
+                up = self.table.hierarchies[columns[i]].ups[parent[i]]
+                result = self.sets[columns, parent].rollup(i, up)
+                break
+        else:
+            result = FrequencySet.from_codes(self.table.generalize(columns, node))
+        self.put(key, result)
+        return result
+
+    def put(self, key: tuple[Columns, Levels], frequencies: FrequencySet):
+        if frequencies.nbytes > self.max_bytes:
+            return
+        while self.size + frequencies.nbytes > self.max_bytes:
+            self.size -= self.sets.pop(next(iter(self.sets))).nbytes
+        self.sets[key] = frequencies
+        self.size += frequencies.nbytes
+
+    def discard(self, columns: Columns, height: int):
+        for key in [key for key in self.sets if key[0] == columns]:
+            if sum(key[1]) < height:
+                self.size -= self.sets.pop(key).nbytes
+
+
+def parents_of(node: Levels) -> Iterator[tuple[int, Levels]]:
+    for i, level in enumerate(node):
+        if level > 0:
+            yield i, node[:i] + (level - 1,) + node[i + 1 :]
+
+
+def nodes_at(heights: Levels, height: int) -> list[Levels]:
+    return [
+        node
+        for node in product(*(range(h + 1) for h in heights))
+        if sum(node) == height
+    ]
+
+
+def precision_loss(node: Levels, heights: Levels) -> float:
+    return sum(l / h for l, h in zip(node, heights) if h) / len(heights)
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    levels: dict[str, int]
+    loss: float
+    score: Score
+    evaluated: int
+
+
+type Evaluator = Callable[[Columns, Sequence[Levels]], Sequence[Score]]
+
+
+class ParallelEvaluator:
+    # The codes are copied once in shared memory, the workers attach to them
+    # and score batches of nodes, each with its own frequency cache
+    def __init__(self, table: CodedTable, k: int, workers: int, max_bytes: int):
+        self.workers = workers
+        self.memory = SharedMemory(create=True, size=max(table.codes.nbytes, 1))
+        codes = np.ndarray(table.codes.shape, np.int64, buffer=self.memory.buf)
+        codes[:] = table.codes
+        self.pool = ProcessPoolExecutor(
+            workers,
+            get_context("forkserver"),
+            initializer=attach,
+            initargs=(
+                self.memory.name,
+                table.codes.shape,
+                table.columns,
+                table.hierarchies,
+                k,
+                max_bytes // workers,
+            ),
+        )
+
+    def __call__(self, columns: Columns, nodes: Sequence[Levels]) -> list[Score]:
+        size = max(1, -(-len(nodes) // (4 * self.workers)))
+        batches = [(columns, batch) for batch in batched(nodes, size)]
+        return [score for scores in self.pool.map(score, batches) for score in scores]
+
+    def __enter__(self) -> ParallelEvaluator:
+        return self
+
+    def __exit__(self, *_: Any):
+        self.pool.shutdown()
+        self.memory.close()
+        self.memory.unlink()
+
+
+worker: tuple[SharedMemory, FrequencyCache, int] | None = None
+
+
+def attach(
+    name: str,
+    shape: tuple[int, int],
+    columns: list[str],
+    hierarchies: list[Hierarchy],
+    k: int,
+    max_bytes: int,
+):
+    global worker
+    memory = SharedMemory(name)
+    codes = np.ndarray(shape, np.int64, buffer=memory.buf)
+    table = CodedTable(columns, codes, hierarchies)
+    worker = (memory, FrequencyCache(table, max_bytes), k)
+
+
+def score(batch: tuple[Columns, tuple[Levels, ...]]) -> list[Score]:
+    assert worker is not None
+    _, cache, k = worker
+    columns, nodes = batch
+    return [cache[columns, node].score(k) for node in nodes]
+
+
+def incognito(
+    table: CodedTable,
+    k: int,
+    max_suppressed: int = 0,
+    max_bytes: int = 2**30,
+    evaluator: Evaluator | None = None,
+) -> SearchResult | None:
+    # A node can only be k-anonymous if its projections on every subset of the
+    # columns are, so the subsets are searched by increasing size and each one
+    # only evaluates the nodes whose projections survived the previous size
+    heights = table.heights
+    cache = FrequencyCache(table, max_bytes)
+    if evaluator is None:
+        evaluator = lambda columns, nodes: [
+            cache[columns, node].score(k) for node in nodes
+        ]
+    satisfied: dict[Columns, set[Levels]] = {(): {()}}
+    evaluated = 0
+    for size in range(1, len(heights) + 1):
+        for columns in combinations(range(len(heights)), size):
+            subsets = [(i, columns[:i] + columns[i + 1 :]) for i in range(len(columns))]
+            satisfied[columns] = set()
+            for height in range(sum(heights[c] for c in columns) + 1):
+                candidates: list[Levels] = []
+                for node in nodes_at(tuple(heights[c] for c in columns), height):
+                    # Generalization property: above a k-anonymous node every
+                    # node is k-anonymous too
+                    if any(p in satisfied[columns] for _, p in parents_of(node)):
+                        satisfied[columns].add(node)
+                    elif all(
+                        node[:i] + node[i + 1 :] in satisfied[subset]
+                        for i, subset in subsets
+                    ):
+                        candidates.append(node)
+                for node, score in zip(candidates, evaluator(columns, candidates)):
+                    if score.suppressed <= max_suppressed:
+                        satisfied[columns].add(node)
+                evaluated += len(candidates)
+                cache.discard(columns, height)
+            if not satisfied[columns]:
+                return None
+    columns = tuple(range(len(heights)))
+    best = min(satisfied[columns], key=lambda node: precision_loss(node, heights))
+    (score,) = evaluator(columns, [best])
+    return SearchResult(
+        dict(zip(table.columns, best)),
+        precision_loss(best, heights),
+        score,
+        evaluated,
+    )
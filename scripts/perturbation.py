@@ -0,0 +1,91 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from enum import StrEnum, auto
+from typing import Protocol
+from zlib import crc32
+import numpy as np
+from numpy.typing import NDArray
+
+
+class Noise(Protocol):
+    # Maps uniform draws in (0, 1) to noise through the inverse CDF
+    def sample(self, u: NDArray[np.float64], /) -> NDArray[np.float64]:
+        ...
+
+
+@dataclass(frozen=True)
+class UniformNoise(Noise):
+    low: int
+    high: int
+
+    def sample(self, u: NDArray[np.float64], /) -> NDArray[np.float64]:
+        return np.floor(self.low + u * (self.high - self.low + 1))
+
+
+@dataclass(frozen=True)
+class LaplaceNoise(Noise):
+    scale: float
+
+    @classmethod
+    def from_epsilon(cls, epsilon: float, sensitivity: float = 1) -> LaplaceNoise:
+        return cls(sensitivity / epsilon)
+
+    def sample(self, u: NDArray[np.float64], /) -> NDArray[np.float64]:
+        centered = u - 0.5
+        return -self.scale * np.sign(centered) * np.log1p(-2 * np.abs(centered))
+
+
+class Distribution(StrEnum):
+    uniform = auto()
+    laplace = auto()
+
+    def noise(self, scale: float) -> Noise:
+        match self:
+            case Distribution.uniform:
+                return UniformNoise(-int(scale), int(scale))
+            case Distribution.laplace:
+                return LaplaceNoise(scale)
+
+
+@dataclass(frozen=True)
+class Perturbation:
+    noise: Noise
+    minimum: float | None = None
+    integer: bool = True
+
+    def apply(
+        self, values: NDArray[np.float64], rows: NDArray[np.int64], key: int
+    ) -> NDArray[np.float64]:
+        result = values + self.noise.sample(uniforms(rows, key))
+        if self.integer:
+            result = np.round(result).astype(np.int64)
+        if self.minimum is not None:
+            result = np.maximum(result, self.minimum)
+        return result
+
+
+# Counter values drawn at once by uniforms
+BLOCK = 1024
+
+
+def column_key(seed: int, column: str) -> int:
+    return (seed << 32 | crc32(column.encode())) % 2**128
+
+
+def uniforms(rows: NDArray[np.int64], key: int) -> NDArray[np.float64]:
+    # Philox is counter based: the draw of a row only depends on the key and on
+    # the row identity, so any chunking of the rows yields the same noise.
+    # Rows are drawn a block of counter values at a time, so sparse rows only
+    # cost the blocks they fall in
+    rows = np.asarray(rows, dtype=np.int64)
+    result = np.empty(len(rows))
+    order = np.argsort(rows, kind="stable")
+    blocks, starts = np.unique(rows[order] // BLOCK, return_index=True)
+    for block, segment in zip(blocks, np.split(order, starts[1:])):
+        counter = int(block) * BLOCK
+        generator = np.random.Generator(np.random.Philox(key=key, counter=counter))
+        # Every counter value produces four 64 bit words, one row uses the
+        # first. Shifted by half a step to stay in the open interval (0, 1)
+        draws = generator.random(4 * BLOCK).reshape(BLOCK, 4)[:, 0] + 2.0**-54
+        result[segment] = draws[rows[segment] - counter]
+    return result
@@ -0,0 +1,100 @@
+from __future__ import annotations
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from itertools import count, islice
+from pathlib import Path
+from faker import Faker
+import numpy as np
+from numpy.typing import NDArray
+import pandas as pd
+
+type Provider = Callable[[Faker], str]
+
+BLOCK_SIZE = 1024
+
+
+@dataclass
+class PseudonymTable:
+    originals: list[str] = field(default_factory=list)
+    pseudonyms: list[str] = field(default_factory=list)
+    index: dict[str, int] = field(init=False, repr=False)
+    # The pseudonyms again, in an object array with room to grow, so that a
+    # chunk is substituted without converting the whole table
+    array: NDArray[np.object_] = field(init=False, repr=False)
+    # Generator of the next pseudonyms for a provider and seed, kept between
+    # chunks so that Faker is not reseeded and replayed every time
+    stream: tuple[Provider, int, Iterator[str]] | None = field(
+        default=None, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        self.index = {o: i for i, o in enumerate(self.originals)}
+        self.array = np.array(self.pseudonyms, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.originals)
+
+    @classmethod
+    def load(cls, file: Path) -> PseudonymTable:
+        with np.load(file) as table:
+            return cls(table["originals"].tolist(), table["pseudonyms"].tolist())
+
+    def save(self, file: Path):
+        file.parent.mkdir(parents=True, exist_ok=True)
+        with open(file, "wb") as f:
+            np.savez_compressed(
+                f,
+                originals=np.array(self.originals, dtype=str),
+                pseudonyms=np.array(self.pseudonyms, dtype=str),
+            )
+
+    def extend(self, values: Iterable[str], provider: Provider, seed: int):
+        new = [v for v in values if v not in self.index]
+        if not new:
+            return
+        if self.stream is None or self.stream[:2] != (provider, seed):
+            self.stream = provider, seed, generate(provider, seed, len(self))
+        start = len(self)
+        self.index.update((v, i) for i, v in enumerate(new, start=start))
+        self.originals.extend(new)
+        self.pseudonyms.extend(islice(self.stream[2], len(new)))
+        if len(self) > len(self.array):
+            grown = np.empty(max(len(self), 2 * len(self.array)), dtype=object)
+            grown[:start] = self.array[:start]
+            self.array = grown
+        self.array[start : len(self)] = self.pseudonyms[start:]
+
+    def substitute(
+        self, values: Iterable[str], provider: Provider, seed: int
+    ) -> NDArray[np.object_]:
+        codes, uniques = pd.factorize(np.fromiter(values, dtype=object))
+        self.extend(uniques, provider, seed)
+        positions = np.fromiter(
+            (self.index[u] for u in uniques), dtype=np.intp, count=len(uniques)
+        )
+        return self.array[positions[codes]]
+
+
+def generate(provider: Provider, seed: int, start: int) -> Iterator[str]:
+    # The i-th pseudonym only depends on the seed and on i, so that a table
+    # grown chunk by chunk or run by run matches one generated in a single pass.
+    # Faker is reseeded at the start of every block, only the part of the
+    # first block before start is generated and thrown away
+    faker = Faker()
+    faker.seed_instance(f"{seed}:{start // BLOCK_SIZE}")
+    for _ in range(start % BLOCK_SIZE):
+        provider(faker)
+    for i in count(start):
+        if i % BLOCK_SIZE == 0:
+            faker.seed_instance(f"{seed}:{i // BLOCK_SIZE}")
+        yield provider(faker)
+
+
+def table_file(cache: Path, column: str, seed: int) -> Path:
+    return cache / f"{column}-{seed}.npz"
+
+
+def load_table(cache: Path | None, column: str, seed: int) -> PseudonymTable:
+    if cache is None or not table_file(cache, column, seed).exists():
+        return PseudonymTable()
+    return PseudonymTable.load(table_file(cache, column, seed))
@@ -0,0 +1,218 @@
+from __future__ import annotations
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Optional
+from pandas import DataFrame
+from typer import Typer
+
+from cache import ResultCache, digest_file
+from data import Data, User
+from paper import (
+    Operation,
+    anonymize_data,
+    check_anonymized,
+    classes_key,
+    divide_nodes,
+    CSRGraph,
+    extract_interaction_csr,
+    generate_uniform_lists,
+    load_classes,
+    ordering_function,
+    prefix_pattern,
+    store_classes,
+)
+from profiling import profiled
+
+
+@dataclass(frozen=True)
+class SweepRow:
+    operation: Operation
+    m: int
+    k: int | None
+    # Classes counted like AnonymizedData.classes, one uniform list per user,
+    # and how many of them hold different users
+    classes: int
+    distinct: int
+    edges: int
+    partition_seconds: float
+    seconds: float
+
+    @property
+    def name(self) -> str:
+        k = "" if self.k is None else f"-k{self.k}"
+        return f"{self.operation}-m{self.m}{k}"
+
+
+# Interaction graph relabelled to the positions of its nodes, with the ordering
+# key of each position, shared by the partition workers
+partition_input: tuple[CSRGraph[int], list[Any]] | None = None
+
+
+def init_partition(graph: CSRGraph[int], keys: list[Any]):
+    global partition_input
+    partition_input = (graph, keys)
+
+
+def partition(m: int) -> tuple[list[list[int]], float]:
+    assert partition_input is not None
+    graph, keys = partition_input
+    start = perf_counter()
+    classes = divide_nodes(graph, m, keys.__getitem__, progress=False)
+    assert check_anonymized(graph, classes)
+    # In the order divide_nodes inserted them, so that the sets of users built
+    # back from them iterate like the ones of an in-process partition
+    rank = {u: i for i, u in enumerate(sorted(graph, key=keys.__getitem__))}
+    return [sorted(c, key=rank.__getitem__) for c in classes], perf_counter() - start
+
+
+def partitions(
+    data: Data, ms: Sequence[int], workers: int
+) -> Iterator[tuple[int, list[frozenset[User]], float]]:
+    # The interaction graph is extracted once, and the partition of every m is
+    # computed in its own process
+    interaction_graph = extract_interaction_csr(data.all_graphs().values())
+    nodes = interaction_graph.nodes
+    graph = CSRGraph(
+        [*range(len(nodes))], interaction_graph.indptr, interaction_graph.indices
+    )
+    keys = [ordering_function(u) for u in nodes]
+    with ProcessPoolExecutor(
+        workers, get_context("forkserver"), init_partition, (graph, keys)
+    ) as pool:
+        for m, (classes, seconds) in zip(ms, pool.map(partition, ms)):
+            yield m, [frozenset({*(nodes[i] for i in c)}) for c in classes], seconds
+
+
+def class_edges(data: Data, mapping: dict[User, Any]) -> int:
+    return sum(
+        len({(mapping[u], mapping[v]) for u, v in graph.edges()})
+        for graph in data.all_graphs().values()
+    )
+
+
+def sweep_partition(
+    data: Data,
+    m: int,
+    classes: list[frozenset[User]],
+    ks: Sequence[int],
+    operations: Sequence[Operation],
+    partition_seconds: float,
+) -> Iterator[SweepRow]:
+    # Only the statistics are computed, the anonymized graphs are never built
+    if Operation.uniform_list in operations:
+        for k in ks:
+            start = perf_counter()
+            mapping = generate_uniform_lists(
+                classes, prefix_pattern(k), ordering_function
+            )
+            lists = len({c.nodes for c in mapping.values()})
+            edges = class_edges(data, {u: c.nodes for u, c in mapping.items()})
+            yield SweepRow(
+                Operation.uniform_list,
+                m,
+                k,
+                len(mapping),
+                lists,
+                edges,
+                partition_seconds,
+                perf_counter() - start,
+            )
+    if Operation.partitioning in operations:
+        start = perf_counter()
+        edges = class_edges(data, {u: i for i, c in enumerate(classes) for u in c})
+        yield SweepRow(
+            Operation.partitioning,
+            m,
+            None,
+            len(classes),
+            len(classes),
+            edges,
+            partition_seconds,
+            perf_counter() - start,
+        )
+
+
+def cached_partitions(
+    data: Data, ms: Sequence[int], cache: ResultCache, digest: str, workers: int
+) -> Iterator[tuple[int, list[frozenset[User]], float]]:
+    # Hits are read back, misses go through the pool like an uncached sweep
+    hits: dict[int, Path] = {}
+    for m in ms:
+        file = cache.get(classes_key(digest, m), ".json")
+        if file is not None:
+            hits[m] = file
+    misses = [m for m in ms if m not in hits]
+    computed: dict[int, tuple[list[frozenset[User]], float]] = {}
+    if misses:
+        for m, classes, seconds in partitions(data, misses, workers):
+            store_classes(cache, classes_key(digest, m), classes)
+            computed[m] = classes, seconds
+    for m in ms:
+        if m in computed:
+            yield m, *computed[m]
+        else:
+            start = perf_counter()
+            classes = load_classes(data, hits[m])
+            yield m, classes, perf_counter() - start
+
+
+def sweep(
+    data: Data,
+    ms: Sequence[int],
+    ks: Sequence[int],
+    operations: Sequence[Operation] = (*Operation,),
+    workers: int = 1,
+    cache: ResultCache | None = None,
+    digest: str | None = None,
+    output_dir: Path | None = None,
+) -> DataFrame[str, int, Any]:
+    if cache is not None and digest is not None:
+        results = cached_partitions(data, ms, cache, digest, workers)
+    else:
+        results = partitions(data, ms, workers)
+    rows: list[SweepRow] = []
+    for m, classes, seconds in results:
+        for row in sweep_partition(data, m, classes, ks, operations, seconds):
+            rows.append(row)
+            # Outputs are only materialized when asked for
+            if output_dir is not None:
+                pattern = prefix_pattern(row.k or 0)
+                new_data = anonymize_data(
+                    data, row.operation, m, pattern, classes=classes
+                )
+                new_data.dump(str(output_dir / f"{row.name}.json"))
+    return DataFrame([asdict(row) for row in rows]).astype({"k": "Int64"})
+
+
+app = Typer(pretty_exceptions_enable=False)
+
+
+@app.command()
+@profiled
+def main(
+    input: Path,
+    m: list[int] = [10],
+    k: list[int] = [10],
+    operation: list[Operation] = [*Operation],
+    workers: int = 1,
+    summary: Optional[Path] = None,
+    output_dir: Optional[Path] = None,
+    cache_dir: Optional[Path] = None,
+):
+    data = Data.load(str(input))
+    cache = None if cache_dir is None else ResultCache(cache_dir)
+    digest = None if cache is None else digest_file(input)
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    table = sweep(data, m, k, operation, workers, cache, digest, output_dir)
+    print(table.to_string(index=False))
+    if summary is not None:
+        table.to_csv(summary, index=False)
+
+
+if __name__ == "__main__":
+    app()
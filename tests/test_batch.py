@@ -0,0 +1,80 @@
+from io import StringIO
+from pathlib import Path
+from socket import AF_UNIX, socket
+from threading import Thread
+from networkx import DiGraph
+from pytest import raises
+from typer import BadParameter
+
+from batch import Job, JobServer, read_manifest, run_jobs, warm, worker_pool
+from benchmarks.synthetic import synthetic_data, synthetic_users
+from data import Data, type_adapter
+from paper import AnonymizedData, Operation
+
+USERS = synthetic_users(20)
+DATA = synthetic_data(
+    USERS, DiGraph({i: range(i + 1, min(i + 4, 20)) for i in range(20)})
+)
+
+
+def test_read_manifest():
+    manifest = StringIO(
+        '{"input": "a.json", "output": "b.json", "operation": "partitioning"}\n\n'
+        '{"input": "a.json", "output": "c.json", "operation": "uniform_list", "k": 3}\n'
+    )
+    jobs = [*read_manifest(manifest)]
+    assert jobs[0] == Job(
+        input="a.json", output="b.json", operation=Operation.partitioning
+    )
+    assert jobs[1].k == 3 and jobs[1].m == 10
+    with raises(BadParameter):
+        [*read_manifest(StringIO('{"input": "a.json"}\n'))]
+
+
+def test_warm():
+    # A lazy load after warm builds no adapter of its own
+    dump = DATA.model_dump()
+    type_adapter.cache_clear()
+    warm()
+    misses = type_adapter.cache_info().misses
+    Data.model_validate(dump, lazy=True)
+    assert type_adapter.cache_info().misses == misses
+
+
+def test_run_jobs(tmp_path: Path):
+    DATA.dump(str(tmp_path / "data.json"))
+    jobs = [
+        Job(
+            input=str(tmp_path / "data.json"),
+            output=str(tmp_path / f"{i}.json"),
+            operation=[*Operation][i % 2],
+            m=2 + i,
+        )
+        for i in range(5)
+    ]
+    jobs.append(Job(input="missing.json", output="x.json", operation="partitioning"))
+    with worker_pool(2) as pool:
+        results = [*run_jobs(jobs, pool, None, 2)]
+    assert sorted(r.job.output for r in results) == sorted(j.output for j in jobs)
+    for result in results:
+        assert (result.error is None) == (result.job.input != "missing.json")
+        if result.error is None:
+            assert len(AnonymizedData.load(result.job.output).users) == 20
+
+
+def test_job_server(tmp_path: Path):
+    DATA.dump(str(tmp_path / "data.json"))
+    job = Job(
+        input=str(tmp_path / "data.json"),
+        output=str(tmp_path / "out.json"),
+        operation=Operation.partitioning,
+    )
+    with worker_pool(1) as pool, JobServer(tmp_path / "socket", pool, None) as server:
+        Thread(target=server.serve_forever, daemon=True).start()
+        with socket(AF_UNIX) as client:
+            client.connect(str(tmp_path / "socket"))
+            client.sendall(job.model_dump_json().encode() + b"\n")
+            response = client.makefile("rb").readline()
+        server.shutdown()
+    assert b'"error":null' in response
+    assert (tmp_path / "out.json").exists()
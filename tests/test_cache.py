@@ -0,0 +1,52 @@
+from os import utime
+from pathlib import Path
+from cache import TEMP, ResultCache, cache_key, digest_file
+
+
+def test_cache_key():
+    assert cache_key("a", 1, [0, 1]) == cache_key("a", 1, [0, 1])
+    assert cache_key("a", 1, [0, 1]) != cache_key("a", 1, [0, 2])
+
+
+def test_digest_file(tmp_path: Path):
+    (tmp_path / "a").write_bytes(b"data")
+    (tmp_path / "b").write_bytes(b"data")
+    assert digest_file(tmp_path / "a") == digest_file(tmp_path / "b")
+
+
+def test_result_cache(tmp_path: Path):
+    cache = ResultCache(tmp_path / "cache")
+    assert cache.get(cache_key(1), ".json") is None
+    cache.put_bytes(cache_key(1), ".json", b"[1]")
+    assert not cache.restore(cache_key(2), ".json", tmp_path / "out.json")
+    assert cache.restore(cache_key(1), ".json", tmp_path / "out.json")
+    assert (tmp_path / "out.json").read_bytes() == b"[1]"
+
+
+def test_result_cache_eviction(tmp_path: Path):
+    cache = ResultCache(tmp_path, max_bytes=25)
+    for i in range(3):
+        file = cache.put_bytes(cache_key(i), ".bin", bytes(10))
+        utime(file, ns=(i, i))
+    assert cache.get(cache_key(0), ".bin") is None
+    # A hit makes 1 the most recently used entry
+    assert cache.get(cache_key(1), ".bin") is not None
+    cache.put_bytes(cache_key(3), ".bin", bytes(10))
+    assert cache.get(cache_key(2), ".bin") is None
+    assert cache.get(cache_key(1), ".bin") is not None
+    assert cache.get(cache_key(3), ".bin") is not None
+
+
+def test_result_cache_large_entry(tmp_path: Path):
+    cache = ResultCache(tmp_path, max_bytes=25)
+    cache.put_bytes(cache_key(0), ".bin", bytes(10))
+    # An entry over the budget evicts the others but is kept itself
+    file = cache.put_bytes(cache_key(1), ".bin", bytes(30))
+    assert file.exists()
+    assert cache.get(cache_key(0), ".bin") is None
+    # Entries being written are neither counted nor evicted
+    (file.parent / f"partial{TEMP}").write_bytes(bytes(100))
+    assert cache.entries() == [file]
+    cache.put_bytes(cache_key(1), ".bin", bytes(20))
+    assert (file.parent / f"partial{TEMP}").exists()
+    assert file.read_bytes() == bytes(20)
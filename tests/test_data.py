@@ -0,0 +1,130 @@
+from json import dump, dumps
+from pathlib import Path
+from itertools import product
+from random import Random
+from networkx import DiGraph, MultiDiGraph
+from pytest import raises
+import networkx as nx
+from data import Data, UserTable, iter_field, load_graph
+from benchmarks.synthetic import synthetic_data, synthetic_users
+from paper import compute_classes
+
+DOCUMENT = {
+    "users": [{"username": "a", "cap": 12345}, {"username": "b", "cap": 1}],
+    "empty": [],
+    "following": {"a": ["b"], "b": []},
+    "count": 12345,
+}
+
+
+def test_iter_field(tmp_path: Path):
+    file = tmp_path / "data.json"
+    file.write_text(dumps(DOCUMENT))
+    for block_size in [1, 7, 2**16]:
+        assert [*iter_field(file, "users", block_size)] == DOCUMENT["users"]
+        assert dict(iter_field(file, "following", block_size)) == {
+            "a": ["b"],
+            "b": [],
+        }
+        assert [*iter_field(file, "empty", block_size)] == []
+        assert [*iter_field(file, "count", block_size)] == [12345]
+        assert [*iter_field(file, "missing", block_size)] == []
+
+
+def random_input(rng: Random, multi: bool) -> dict[str, list[str]]:
+    ids = [f"u{i}" for i in range(30)]
+    rng.shuffle(ids)
+    # Some ids only appear as neighbours, some lists repeat or contain the key
+    return {
+        i: (rng.choices if multi else rng.sample)(ids, k=rng.randrange(6))
+        for i in ids[:25]
+    }
+
+
+def test_load_graph():
+    rng = Random(42)
+    for graph_type in [DiGraph, MultiDiGraph]:
+        for _ in range(20):
+            input = random_input(rng, graph_type is MultiDiGraph)
+            nodes = {f"u{i}": (i,) for i in range(30)}
+            expected = nx.from_dict_of_lists(input, graph_type())
+            nx.relabel_nodes(expected, nodes, copy=False)
+            actual = graph_type()
+            load_graph(actual, input, nodes)
+            assert [*actual] == [*expected]
+            for u in actual:
+                assert [*actual.succ[u].items()] == [*expected.succ[u].items()]
+                assert [*actual.pred[u].items()] == [*expected.pred[u].items()]
+
+
+def random_data(rng: Random) -> Data:
+    edges = rng.choices([*product(range(25), repeat=2)], k=80)
+    return synthetic_data(synthetic_users(25, prefix="user\u00e8"), DiGraph(edges))
+
+
+def test_dump(tmp_path: Path):
+    rng = Random(42)
+    for _ in range(5):
+        data = random_data(rng)
+        ids = {u: u.username for u in data.users}
+        expected = {
+            "users": [u.model_dump(mode="json") for u in data.users],
+            "following": nx.to_dict_of_lists(nx.relabel_nodes(data.following, ids)),
+        }
+        assert data.model_dump() == expected
+        with open(tmp_path / "expected.json", "wt") as f:
+            dump(expected, f)
+        data.dump(str(tmp_path / "data.json"))
+        assert (tmp_path / "data.json").read_text() == (
+            tmp_path / "expected.json"
+        ).read_text()
+        assert data.model_dump_json() == dumps(expected)
+
+
+def test_lazy_load(tmp_path: Path):
+    rng = Random(42)
+    for _ in range(5):
+        random_data(rng).dump(str(tmp_path / "data.json"))
+        data = Data.load(str(tmp_path / "data.json"))
+        lazy = Data.load(str(tmp_path / "data.json"), lazy=True)
+        assert isinstance(lazy.users, UserTable)
+        assert lazy.model_dump_json() == data.model_dump_json()
+        assert [*lazy.users] == data.users
+        assert [u.model() for u in lazy.users] == data.users
+        assert {*lazy.following} == {*data.following}
+        assert lazy.users.birth_date.tolist() == [u.birth_date for u in data.users]
+        assert [u.age for u in lazy.users] == [u.age for u in data.users]
+        username = lambda c: sorted(u.username for u in c)
+        for m in [1, 3, 10]:
+            assert [*map(username, compute_classes(lazy, m))] == [
+                *map(username, compute_classes(data, m))
+            ]
+
+
+def test_lazy_validation():
+    records = [u.model_dump(mode="json") for u in synthetic_users(3)]
+    table = UserTable.from_records(records)
+    assert table[1] == synthetic_users(3)[1]
+    assert table[1] != synthetic_users(3)[2]
+    # Malformed records are rejected like by the eager load
+    for record in [
+        {**records[1], "cap": "cap"},
+        {**records[1], "gender": "none"},
+        {**records[1], "birth_date": "2000-13-01"},
+        {**records[1], "name": None},
+        {k: v for k, v in records[1].items() if k != "email"},
+    ]:
+        with raises(ValueError):
+            UserTable.from_records([records[0], record])
+
+
+def test_manifest(tmp_path: Path):
+    data = random_data(Random(42))
+    file = tmp_path / "data.json"
+    manifest = data.dump(str(file))
+    manifest.check(file)
+    assert manifest.nodes == 25
+    assert manifest.edges == {"following": data.following.number_of_edges()}
+    file.write_text(file.read_text().replace("user", "resu"))
+    with raises(ValueError):
+        manifest.check(file)
@@ -1,14 +1,31 @@
 from datetime import date
+import json
+from pathlib import Path
+from networkx import DiGraph
+from faker import Faker
+import numpy as np
+from pandas import concat
+from pytest import raises
+from cache import ResultCache
 from data import Gender
+from benchmarks.synthetic import synthetic_data, synthetic_users
 
 from scripts.generalization import (
+    EI,
+    anonymize_data,
+    anonymize_stream,
     generalize_address,
     generalize_birth_date,
     generalize_cap,
     generalize_city,
     generalize_gender,
     generalize_phone_number,
+    main,
+    preprocessing,
+    stream_preprocessing,
+    substitute,
 )
+from scripts.pseudonyms import PseudonymTable
 
 
 def test_generalize_cap():
@@ -60,3 +77,92 @@ def test_generalize_phone_number():
     assert generalize_phone_number("3791211697", 8) == "37********"
     assert generalize_phone_number("3791211697", 9) == "3*********"
     assert generalize_phone_number("3791211697", 10) == "**********"
+
+
+def test_substitute():
+    values = ["a", "b", "a", "c", "b"]
+    actual = substitute(values, EI["username"], 42)
+    assert actual[0] == actual[2] and actual[1] == actual[4]
+    assert len({*actual}) == 3
+
+
+def test_pseudonym_table(tmp_path: Path):
+    table = PseudonymTable()
+    first = substitute(["a", "b", "a"], EI["email"], 42, table)
+    table.save(tmp_path / "email.npz")
+    loaded = PseudonymTable.load(tmp_path / "email.npz")
+    second = substitute(["c", "b", "a"], EI["email"], 42, loaded)
+    assert [*second[1:]] == [first[1], first[0]]
+    assert len(loaded) == 3
+
+
+def test_pseudonym_table_chunks():
+    calls = []
+
+    def provider(faker: Faker) -> str:
+        calls.append(None)
+        return faker.user_name()
+
+    values = [f"user{i}" for i in range(3000)]
+    expected = PseudonymTable().substitute(values, provider, 42)
+    table = PseudonymTable()
+    chunks = [
+        table.substitute(values[i : i + 7], provider, 42) for i in range(0, 3000, 7)
+    ]
+    assert [*np.concatenate(chunks)] == [*expected]
+    # Every pseudonym is generated once, however small the chunks
+    assert len(calls) == 2 * len(values)
+
+
+USERS = synthetic_users(20)
+DATA = synthetic_data(
+    USERS, DiGraph({i: range(i + 1, min(i + 3, 20)) for i in range(20)})
+)
+
+
+def test_preprocessing():
+    df = preprocessing(DATA)
+    assert df["followers"].tolist() == [0, 1, *[2] * 18]
+    assert df["birth_date"].dt.day.tolist() == [*range(1, 21)]
+    assert df["cap"].dtype == "int32"
+    assert df["city"].dtype == "category"
+    assert df["username"].tolist() == [u.username for u in USERS]
+
+
+def test_anonymize_stream(tmp_path: Path):
+    (tmp_path / "data.json").write_text(DATA.model_dump_json())
+    expected = anonymize_data(preprocessing(DATA), 42, 2)
+    chunks = stream_preprocessing(tmp_path / "data.json", 7)
+    actual = concat([*anonymize_stream(chunks, 42)], ignore_index=True)
+    assert actual.astype(str).equals(expected.astype(str))
+
+
+def test_stream_validation(tmp_path: Path):
+    data = json.loads(DATA.model_dump_json())
+    data["users"][3]["cap"] = "not a cap"
+    (tmp_path / "data.json").write_text(json.dumps(data))
+    with raises(ValueError, match="user 3 has an invalid cap"):
+        [*stream_preprocessing(tmp_path / "data.json", 7)]
+
+
+def test_cache_key(tmp_path: Path):
+    (tmp_path / "data.json").write_text(DATA.model_dump_json())
+    cache = ResultCache(tmp_path / "cache")
+    for k in [2, 3]:
+        main(
+            tmp_path / "data.json",
+            str(tmp_path / "out.csv"),
+            k=k,
+            cache_dir=cache.directory,
+        )
+    # k is only used by the optimal search
+    assert len(cache.entries()) == 1
+    for k in [2, 3]:
+        main(
+            tmp_path / "data.json",
+            str(tmp_path / "out.csv"),
+            k=k,
+            optimal=True,
+            cache_dir=cache.directory,
+        )
+    assert len(cache.entries()) == 3
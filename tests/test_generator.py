@@ -0,0 +1,44 @@
+from pathlib import Path
+import networkx as nx
+import numpy as np
+from data import Data
+from benchmarks.synthetic import synthetic_data, synthetic_users
+from generator import RELATIONS, Relation, generate_relation
+from paper import AnonymizedData, Operation, anonymize_data, prefix_pattern
+
+USERS = synthetic_users(100)
+FOLLOWING = synthetic_data(
+    USERS, nx.gnp_random_graph(100, 0.05, seed=42, directed=True)
+).following
+
+
+def test_generate_relation():
+    rng = np.random.default_rng(42)
+    copied = generate_relation(FOLLOWING, USERS, Relation(1, 1, 1), rng)
+    assert {*copied.edges()} <= {*FOLLOWING.edges()}
+    # Once following is exhausted, the remaining edges are drawn by popularity
+    exhausted = generate_relation(FOLLOWING, USERS, Relation(10, 1, 1), rng)
+    assert {*exhausted.edges()} > {*FOLLOWING.edges()}
+    likes = generate_relation(FOLLOWING, USERS, RELATIONS["likes"], rng)
+    assert not any(u == v for u, v in likes.edges())
+    assert 0 < likes.number_of_edges() <= 5 * len(USERS)
+
+
+def test_relations_round_trip(tmp_path: Path):
+    rng = np.random.default_rng(42)
+    data = Data(
+        users=USERS,
+        following=FOLLOWING,
+        likes=generate_relation(FOLLOWING, USERS, RELATIONS["likes"], rng),
+        messages=generate_relation(FOLLOWING, USERS, RELATIONS["messages"], rng),
+    )
+    data.dump(str(tmp_path / "data.json"))
+    loaded = Data.load(str(tmp_path / "data.json"))
+    assert [*loaded.all_graphs()] == ["following", "likes", "messages"]
+    assert loaded.comments is None
+    assert {*loaded.likes.edges()} == {*data.likes.edges()}
+    for operation in Operation:
+        anonymized = anonymize_data(loaded, operation, 5, prefix_pattern(3))
+        anonymized.dump(str(tmp_path / "anonymized.json"))
+        result = AnonymizedData.load(str(tmp_path / "anonymized.json"))
+        assert [*result.all_graphs()] == ["following", "likes", "messages"]
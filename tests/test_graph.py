@@ -1,5 +1,17 @@
+from random import Random
+import networkx as nx
+import numpy as np
 from networkx import Graph
-from scripts.graph import check_strong, check_weak, anonymize
+from scripts.graph import (
+    OverlapTracker,
+    anonymize,
+    check_strong,
+    check_weak,
+    common_neighbours,
+    lsh_bands,
+    minhash,
+    screen_weak,
+)
 
 G = Graph(
     {
@@ -52,3 +64,72 @@ def test_check_anonymize():
     Ga = anonymize(G)
     assert check_weak(Ga, 2, 1)
     assert Ga != G
+
+
+def test_lsh_bands():
+    bands, rows = lsh_bands(128, 0.5, 0.05)
+    assert bands * rows <= 128
+    assert (1 - 0.5**rows) ** bands <= 0.05
+    # One more row per band would miss too many pairs
+    assert (1 - 0.5 ** (rows + 1)) ** (128 // (rows + 1)) > 0.05
+
+
+def test_minhash_blocks():
+    rng = Random(42)
+    neighbourhoods = [
+        [rng.randrange(100) for _ in range(rng.randrange(1, 20))] for _ in range(50)
+    ]
+    expected = minhash(neighbourhoods, 16, 42, block=10**6)
+    for block in [1, 10, 100]:
+        assert (minhash(neighbourhoods, 16, 42, block=block) == expected).all()
+
+
+def test_common_neighbours():
+    graph = nx.gnp_random_graph(60, 0.2, seed=42)
+    neighbourhoods = [sorted(graph[u]) for u in graph]
+    indptr = np.cumsum([0, *map(len, neighbourhoods)])
+    indices = np.fromiter((v for n in neighbourhoods for v in n), np.int64)
+    pairs = np.array([(u, v) for u in graph for v in graph if u < v])
+    expected = [len({*graph[u]} & {*graph[v]}) for u, v in pairs]
+    for block in [1, 10, 10**6]:
+        actual = common_neighbours(indptr, indices, pairs, block=block)
+        assert actual.tolist() == expected
+
+
+def test_screen_weak():
+    for graph in [G, Gm, Graph(nx.scale_free_graph(200, seed=42))]:
+        for k, l in [(1, 1), (2, 1), (3, 1), (2, 2)]:
+            exact = {
+                v
+                for v in graph
+                if sum(len({*graph[v]} & {*graph[u]}) >= l for u in graph if u != v) < k
+            }
+            at_risk = screen_weak(graph, k, l).at_risk
+            assert exact <= at_risk.keys()
+            assert (not at_risk) <= check_weak(graph, k, l)
+    # Identical neighbourhoods always collide, so nothing is reported
+    assert not screen_weak(nx.complete_bipartite_graph(3, 3), 2, 3, 0.99).at_risk
+
+
+def test_overlap_tracker():
+    graph = Graph(nx.gnp_random_graph(30, 0.1, seed=42))
+    trackers = {(k, l): OverlapTracker(graph, k, l) for k in (1, 2, 4) for l in (1, 2)}
+    rng = Random(42)
+    for _ in range(200):
+        u, v = rng.randrange(32), rng.randrange(32)
+        if graph.has_edge(u, v):
+            graph.remove_edge(u, v)
+        else:
+            graph.add_edge(u, v)
+        for (k, l), tracker in trackers.items():
+            if tracker.G.has_edge(u, v):
+                tracker.remove_edge(u, v)
+            else:
+                tracker.add_edge(u, v)
+            assert tracker.is_anonymous() == check_weak(graph, k, l)
+    tracker = OverlapTracker(G, 4, 1)
+    assert not tracker.is_anonymous()
+    tracker.add_edge(3, 10)
+    tracker.add_edge(10, 5)
+    assert tracker.is_anonymous()
+    assert tracker.partners == OverlapTracker(Gm, 4, 1).partners
@@ -1,4 +1,19 @@
-from scripts.kmeans import Point, distance, kmeans, mean
+from pathlib import Path
+from networkx import DiGraph
+from scripts.kmeans import (
+    MiniBatchKMeans,
+    Point,
+    degree_chunks,
+    distance,
+    dump_degrees,
+    kmeans,
+    kmeans_array,
+    mean,
+    minibatch_kmeans,
+    read_degree_chunks,
+    reservoir_sample,
+)
+import numpy as np
 import statistics
 
 
@@ -7,6 +22,23 @@ def test_kmeans():
     assert {*kmeans([0.0, 1, 2, 3, 4], k=3)} == {0, 1, 2}
 
 
+def test_kmeans_array():
+    rng = np.random.default_rng(42)
+    points = np.concatenate([rng.normal(0, 1, (100, 2)), rng.normal(100, 1, (100, 2))])
+    clusters, centroids = kmeans_array(points, 2, rng, chunk_size=7)
+    assert len({*clusters[:100]}) == 1
+    assert len({*clusters[100:]}) == 1
+    assert clusters[0] != clusters[100]
+    assert np.allclose(sorted(centroids[:, 0]), [0, 100], atol=1)
+
+
+def test_kmeans_array_log():
+    points = np.array([[1, 1], [2, 2], [1000, 1000], [2000, 2000]], dtype=float)
+    clusters, centroids = kmeans_array(points, 2, np.random.default_rng(0), log=True)
+    assert clusters[0] == clusters[1] != clusters[2] == clusters[3]
+    assert centroids.min() > 1 and centroids.max() < 2000
+
+
 def test_mean():
     x: list[float] = [*range(1000)]
     assert mean(x) == statistics.mean(range(1000))
@@ -15,3 +47,43 @@ def test_mean():
 def test_distance():
     assert distance(3.0, 5.0) == 2
     assert distance(Point(0, 0), Point(0, 1)) == 1
+
+
+def test_minibatch_kmeans(tmp_path: Path):
+    rng = np.random.default_rng(42)
+    points = rng.permutation(
+        np.concatenate([rng.normal(0, 1, (500, 2)), rng.normal(100, 1, (500, 2))])
+    )
+    chunks = lambda: (points[i : i + 64] for i in range(0, len(points), 64))
+    model = minibatch_kmeans(chunks, 2, rng)
+    assert np.allclose(sorted(model.cluster_centers()[:, 0]), [0, 100], atol=1)
+    assert model.counts.sum() == len(points)
+
+    model.save(tmp_path / "state.npz")
+    loaded = MiniBatchKMeans.load(tmp_path / "state.npz")
+    assert np.array_equal(loaded.centroids, model.centroids)
+    loaded.partial_fit(np.array([[200.0, 200.0]]))
+    assert loaded.counts.sum() == len(points) + 1
+    assert np.array_equal(loaded.predict(points), model.predict(points))
+
+
+def test_degree_dump(tmp_path: Path):
+    graph = DiGraph({0: [1, 2], 1: [2], 2: [0], 3: []})
+    dump_degrees(graph, tmp_path / "degrees.npy", chunk_size=3)
+    expected = np.concatenate([*degree_chunks(graph, 3)])
+    actual = np.concatenate([*read_degree_chunks(tmp_path / "degrees.npy", 2)])
+    assert np.array_equal(actual, expected)
+    assert actual.tolist() == [[1, 2], [1, 1], [2, 1], [0, 0]]
+
+
+def test_reservoir_sample():
+    rows = np.arange(20000, dtype=float).reshape(-1, 2)
+    chunks = [rows[i : i + 7] for i in range(0, len(rows), 7)]
+    rng = np.random.default_rng(42)
+    assert (reservoir_sample(chunks, 20000, rng) == rows).all()
+    sample = reservoir_sample(chunks, 500, rng)
+    assert sample.shape == (500, 2)
+    assert len({*sample[:, 0]}) == 500
+    assert {*sample[:, 0]} <= {*rows[:, 0]}
+    # Every row is as likely to be kept, wherever its chunk is
+    assert abs(sample[:, 0].mean() - rows[:, 0].mean()) < 1000
@@ -0,0 +1,95 @@
+from itertools import product
+import numpy as np
+from pandas import DataFrame
+from pytest import raises
+
+from scripts.lattice import (
+    FrequencySet,
+    ParallelEvaluator,
+    encode,
+    incognito,
+    precision_loss,
+)
+
+
+def generalize_number(value: int, level: int) -> int:
+    return value // 10**level * 10**level
+
+
+def generalize_name(value: str, level: int) -> str:
+    return value[: len(value) - level]
+
+
+HIERARCHIES = {"number": (generalize_number, 3), "name": (generalize_name, 2)}
+
+rng = np.random.default_rng(42)
+DATA = DataFrame(
+    {
+        "number": rng.integers(0, 1000, 200),
+        "name": rng.choice(["aa", "ab", "ba", "bb", "bc"], 200),
+    }
+)
+
+
+def test_encode():
+    table = encode(DATA, HIERARCHIES)
+    assert table.heights == (3, 2)
+    for levels in product(range(4), range(3)):
+        codes = table.generalize((0, 1), levels)
+        expected = DataFrame(
+            {
+                c: DATA[c].map(lambda v: f(v, l))
+                for (c, (f, _)), l in zip(HIERARCHIES.items(), levels)
+            }
+        )
+        # Same partition of the rows
+        assert (
+            expected.groupby([*expected]).ngroup().factorize()[0].tolist()
+            == DataFrame(codes).groupby([0, 1]).ngroup().factorize()[0].tolist()
+        )
+
+
+def test_encode_not_hierarchy():
+    with raises(ValueError):
+        encode(DATA, {"number": (lambda v, l: v % 10**l, 2)})
+
+
+def test_rollup():
+    table = encode(DATA, HIERARCHIES)
+    bottom = FrequencySet.from_codes(table.generalize((0, 1), (1, 0)))
+    rolled = bottom.rollup(0, table.hierarchies[0].ups[1])
+    direct = FrequencySet.from_codes(table.generalize((0, 1), (2, 0)))
+    assert sorted(rolled.counts.tolist()) == sorted(direct.counts.tolist())
+    assert rolled.counts.sum() == len(DATA)
+
+
+def test_incognito():
+    table = encode(DATA, HIERARCHIES)
+    for k, max_suppressed in [(2, 0), (5, 0), (5, 10), (20, 30)]:
+        result = incognito(table, k, max_suppressed)
+        assert result is not None
+        # Brute force over the whole lattice
+        best = min(
+            (
+                levels
+                for levels in product(range(4), range(3))
+                if table.small_groups(levels, k).sum() <= max_suppressed
+            ),
+            key=lambda levels: precision_loss(levels, table.heights),
+        )
+        assert result.loss == precision_loss(best, table.heights)
+        levels = tuple(result.levels.values())
+        assert table.small_groups(levels, k).sum() == result.score.suppressed
+        assert result.score.suppressed <= max_suppressed
+
+
+def test_incognito_impossible():
+    table = encode(DATA, HIERARCHIES)
+    assert incognito(table, len(DATA) + 1) is None
+
+
+def test_parallel_evaluator():
+    table = encode(DATA, HIERARCHIES)
+    with ParallelEvaluator(table, 5, 2, 2**20) as evaluator:
+        parallel = incognito(table, 5, 10, evaluator=evaluator)
+    assert parallel == incognito(table, 5, 10)
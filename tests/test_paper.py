@@ -5,13 +5,18 @@ from networkx import DiGraph, Graph, MultiDiGraph
 import networkx as nx
 from paper import (
     Class,
+    PartitionStats,
+    Strategy,
     apply_uniform_lists,
     check_anonymized,
     divide_nodes,
+    extract_interaction_csr,
     extract_interaction_graph,
     generate_uniform_lists,
     partition_graph,
     prefix_pattern,
+    strategy_order,
+    uniform_list_view,
 )
 
 INTERACTIONS = [
@@ -137,3 +142,90 @@ def test_apply_uniform_list():
 
 def test_check_anonymized():
     assert check_anonymized(G, Gm2_CLASSES)
+
+
+def test_extract_interaction_csr():
+    graphs = [*INTERACTIONS, MultiDiGraph(INTERACTIONS[2]), DiGraph({"v8": ["v8"]})]
+    expected = extract_interaction_graph(graphs)
+    actual = extract_interaction_csr(graphs)
+    assert [*actual] == [*expected]
+    for u in expected:
+        assert sorted(actual[u]) == sorted(expected[u])
+    assert sorted(map(sorted, actual.edges())) == sorted(map(sorted, expected.edges()))
+    assert divide_nodes(actual, 2, lambda v: v) == divide_nodes(
+        expected, 2, lambda v: v
+    )
+    assert [*extract_interaction_csr([])] == []
+
+
+def test_uniform_list_view():
+    for graph in [G, Graph(G), MultiDiGraph(G)]:
+        expected = apply_uniform_lists(graph, Gm2_CLASSES2)
+        actual = uniform_list_view(graph, Gm2_CLASSES2)
+        assert [*actual] == [*expected]
+        assert [*actual.edges()] == [*expected.edges()]
+        assert actual.number_of_edges() == expected.number_of_edges()
+        for u in expected:
+            assert [*actual.adj[u].items()] == [*expected.adj[u].items()]
+            assert actual.degree(u) == expected.degree(u)
+        assert nx.is_frozen(actual)
+    actual = uniform_list_view(G, Gm2_CLASSES2)
+    assert {*actual.pred[U7]} == {U2, U6}
+    assert U1 in actual and "v1" not in actual
+
+
+def test_networkx_storage():
+    # uniform_list_view replaces these attributes, a networkx release that
+    # renames them must be caught here rather than by wrong outputs
+    for cls in [Graph, DiGraph, MultiDiGraph]:
+        graph = cls([(1, 2)])
+        assert graph._node is graph.nodes._nodes
+        assert graph._adj is graph.adj._atlas
+        if graph.is_directed():
+            assert graph._succ is graph._adj
+            assert graph._pred is graph.pred._atlas
+        view = uniform_list_view(graph, {1: "a"})
+        assert {*view.edges()} == {("a", 2)}
+
+
+def reference_divide_nodes(V, m, ordering):
+    # The partition as written in the paper, every class scanned for every node
+    C = []
+    for v in sorted(V, key=ordering):
+        for cls, sc in C:
+            if not sc & {*V[v], v} and len(cls) < m:
+                break
+        else:
+            cls, sc = set(), set()
+            C.append((cls, sc))
+        cls.add(v)
+        sc |= {*V[v], v}
+    return [frozenset(c) for c, _ in C]
+
+
+def test_divide_nodes_reference():
+    for seed in range(5):
+        graph = nx.gnp_random_graph(80, 0.05, seed=seed)
+        for m in [1, 2, 5]:
+            stats = PartitionStats()
+            classes = divide_nodes(graph, m, lambda v: -v, False, stats=stats)
+            assert classes == reference_divide_nodes(graph, m, lambda v: -v)
+            assert stats.vertices == 80
+            # With m = 1 every class is full as soon as it is created
+            assert (stats.scans == 0) == (m == 1)
+
+
+def test_strategy_order():
+    graph = Graph(nx.scale_free_graph(200, seed=42))
+    graph.remove_edges_from(nx.selfloop_edges(graph))
+    for strategy in Strategy:
+        order = strategy_order(graph, strategy, lambda v: v)
+        assert sorted(order) == sorted(graph)
+        classes = divide_nodes(graph, 5, lambda v: v, False, order=order)
+        assert check_anonymized(graph, classes)
+    degrees = [graph.degree(v) for v in strategy_order(graph, Strategy.degree, str)]
+    assert degrees == sorted(degrees, reverse=True)
+    # Every vertex of a BFS order but the starts follows one of its neighbours
+    order = strategy_order(graph, Strategy.bfs, lambda v: v)
+    assert order[0] == max(graph, key=graph.degree)
+    assert all(any(u in graph[v] for u in order[:i]) for i, v in enumerate(order) if i)
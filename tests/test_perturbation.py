@@ -0,0 +1,44 @@
+import numpy as np
+from scripts.perturbation import (
+    LaplaceNoise,
+    Perturbation,
+    UniformNoise,
+    column_key,
+    uniforms,
+)
+
+
+def test_uniforms_chunking():
+    rows = np.arange(1000)
+    expected = uniforms(rows, 42)
+    actual = np.concatenate(
+        [uniforms(rows[i : i + 64], 42) for i in range(0, 1000, 64)]
+    )
+    assert np.array_equal(actual, expected)
+    assert np.array_equal(uniforms(rows[::-7], 42), expected[::-7])
+    assert ((expected > 0) & (expected < 1)).all()
+    assert not np.array_equal(uniforms(rows, 43), expected)
+    # Far apart rows draw only their own blocks, with the same values
+    sparse = uniforms(np.array([10**12, 3, 10**9]), 42)
+    assert sparse[1] == expected[3]
+    assert sparse[0] == uniforms(np.array([10**12]), 42)[0]
+
+
+def test_uniform_noise():
+    noise = UniformNoise(-10, 10).sample(uniforms(np.arange(10000), 42))
+    assert noise.min() == -10 and noise.max() == 10
+    assert abs(noise.mean()) < 0.5
+
+
+def test_laplace_noise():
+    noise = LaplaceNoise.from_epsilon(0.5).sample(uniforms(np.arange(10000), 42))
+    assert abs(np.median(noise)) < 0.2
+    assert abs(np.abs(noise).mean() - 2) < 0.2
+
+
+def test_perturbation():
+    perturbation = Perturbation(UniformNoise(-10, 10), minimum=0)
+    values = np.zeros(100, dtype=np.int64)
+    result = perturbation.apply(values, np.arange(100), column_key(42, "followers"))
+    assert result.dtype == np.int64
+    assert result.min() == 0 and result.max() <= 10
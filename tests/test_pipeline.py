@@ -0,0 +1,52 @@
+from json import loads
+from pathlib import Path
+from networkx import DiGraph
+from pandas import read_csv
+from typer.testing import CliRunner
+
+from data import Data
+from benchmarks.synthetic import synthetic_data, synthetic_users
+from paper import AnonymizedData, Operation, anonymize_data, prefix_pattern
+from pipeline import app
+
+USERS = synthetic_users(20)
+DATA = synthetic_data(
+    USERS, DiGraph({i: range(i + 1, min(i + 4, 20)) for i in range(20)})
+)
+
+
+def test_pipeline(tmp_path: Path):
+    DATA.dump(str(tmp_path / "data.json"))
+    anonymized = tmp_path / "anonymized.json"
+    result = CliRunner().invoke(
+        app,
+        [
+            "--input",
+            str(tmp_path / "data.json"),
+            "--operation",
+            "partitioning",
+            "--m",
+            "3",
+            "--anonymized",
+            str(anonymized),
+            "--generalized",
+            str(tmp_path / "generalized.csv"),
+            "--verify",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    expected = anonymize_data(DATA, Operation.partitioning, 3, prefix_pattern(10))
+    loaded = AnonymizedData.load(str(anonymized))
+    assert {c.nodes for c in loaded.classes} == {c.nodes for c in expected.classes}
+    manifest = loads(Path(f"{anonymized}.manifest.json").read_text())
+    assert manifest["nodes"] == len(expected.classes)
+    assert len(read_csv(tmp_path / "generalized.csv")) == len(USERS)
+
+
+def test_pipeline_generate(tmp_path: Path):
+    result = CliRunner().invoke(
+        app, ["--n", "30", "--relation", "likes", "--data", str(tmp_path / "d.json")]
+    )
+    assert result.exit_code == 0, result.output
+    assert [*Data.load(str(tmp_path / "d.json")).all_graphs()] == ["following", "likes"]
+    assert not Path(f"{tmp_path / 'd.json'}.manifest.json").exists()
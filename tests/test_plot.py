@@ -0,0 +1,83 @@
+from networkx import DiGraph, MultiDiGraph, closeness_centrality, scale_free_graph
+import networkx as nx
+import pytest
+from typer import BadParameter
+from benchmarks.synthetic import synthetic_data, synthetic_users
+from paper import (
+    Class,
+    Operation,
+    anonymize_data,
+    apply_uniform_lists,
+    partition_graph,
+    prefix_pattern,
+    uniform_list_view,
+)
+from plot import (
+    approximate_closeness,
+    cached_layout,
+    draw_quotient,
+    quotient_graph,
+    sampled_layout,
+)
+
+G = DiGraph(scale_free_graph(200, seed=42))
+
+
+def test_approximate_closeness():
+    expected = closeness_centrality(G)
+    actual = approximate_closeness(G, len(G), seed=42)
+    assert actual == pytest.approx(expected)
+    assert approximate_closeness(G, 20, seed=42).keys() == expected.keys()
+
+
+def test_sampled_layout():
+    pos = sampled_layout(G, k=0.1, seed=42, sample=50)
+    assert pos.keys() == {*G}
+
+
+def test_cached_layout(tmp_path):
+    pos = cached_layout(G, tmp_path, "digest", 42, 0.1, 50)
+    assert len([*tmp_path.iterdir()]) == 1
+    cached = cached_layout(G, tmp_path, "digest", 42, 0.1, 50)
+    assert all((pos[u] == cached[u]).all() for u in G)
+    # The quotient layout of the same file is not the sampled one
+    cached_layout(G, tmp_path, "digest", 42, 0.1, 50, "quotient")
+    assert len([*tmp_path.iterdir()]) == 2
+
+
+def test_quotient_graph():
+    quotient = quotient_graph(MultiDiGraph({1: [1, 1, 2], 2: [1], 3: []}))
+    assert sorted(quotient.edges(data="weight")) == [(1, 1, 2), (1, 2, 1), (2, 1, 1)]
+    assert {*quotient} == {1, 2, 3}
+    # Counted on the original graph, as a dumped anonymized one is a DiGraph
+    users = [*G]
+    partitions = [Class(i, frozenset(users[i : i + 3])) for i in range(0, len(G), 3)]
+    expected = quotient_graph(partition_graph(G, partitions))
+    classes = {u: c for c in partitions for u in c.nodes}
+    assert max(w for _, _, w in expected.edges(data="weight")) > 1
+    assert sorted(quotient_graph(G, classes).edges(data="weight")) == sorted(
+        expected.edges(data="weight")
+    )
+
+
+def test_uniform_list_view():
+    # Drawing code works on a lazy anonymized graph like on a relabelled one
+    users = [*G]
+    classes = {u: Class(i, frozenset(users[i : i + 3])) for i, u in enumerate(users)}
+    expected = apply_uniform_lists(G, classes)
+    view = uniform_list_view(G, classes)
+    assert approximate_closeness(view, 20, seed=42) == approximate_closeness(
+        expected, 20, seed=42
+    )
+    assert sampled_layout(view, k=0.1, seed=42, sample=50).keys() == {*expected}
+    assert [*quotient_graph(view).edges(data="weight")] == [
+        *quotient_graph(expected).edges(data="weight")
+    ]
+
+
+def test_draw_quotient_original():
+    data = synthetic_data(synthetic_users(30), nx.gnp_random_graph(30, 0.2, seed=42))
+    anonymized = anonymize_data(data, Operation.uniform_list, 5, prefix_pattern(3))
+    # The uniform lists of a user overlap, its class is ambiguous
+    with pytest.raises(BadParameter):
+        draw_quotient(anonymized, data, None, None, "digest", 42, 0.1, 50, 10)
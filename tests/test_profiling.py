@@ -0,0 +1,62 @@
+from pathlib import Path
+from time import perf_counter
+import tracemalloc
+from pytest import CaptureFixture
+from typer import Typer
+from typer.testing import CliRunner
+from profiling import STAGES, memory_stage, profiled
+
+app = Typer()
+
+
+def busy(seconds: float) -> int:
+    start = perf_counter()
+    total = 0
+    while perf_counter() - start < seconds:
+        total += 1
+    return total
+
+
+@app.command()
+@profiled
+def main(seconds: float, size: int = 10**6):
+    for _ in range(3):
+        with memory_stage("allocate"):
+            buffer = bytearray(size)
+            del buffer
+    busy(seconds)
+
+
+def test_profile(tmp_path: Path, capsys: CaptureFixture[str]):
+    runner = CliRunner()
+    profile = tmp_path / "profile.txt"
+    result = runner.invoke(
+        app, ["0.2", "--profile", str(profile), "--profile-interval", "0.001"]
+    )
+    assert result.exit_code == 0, result.output
+    lines = profile.read_text().splitlines()
+    stack, samples = lines[0].rsplit(" ", 1)
+    assert stack.startswith("main (test_profiling.py:")
+    assert stack.split(";")[-1].startswith("busy (test_profiling.py:")
+    assert int(samples) > 0
+    main(0.1, profile=profile)
+    assert "busy (test_profiling.py:" in capsys.readouterr().err
+    main(0.1)
+    assert not capsys.readouterr().err
+
+
+def test_profile_memory(tmp_path: Path, capsys: CaptureFixture[str]):
+    profile = tmp_path / "profile.txt"
+    main(0, profile=profile, profile_memory=True)
+    assert not tracemalloc.is_tracing()
+    # Repeated stages are merged
+    assert [*STAGES] == ["allocate", "main"]
+    assert STAGES["allocate"][0] == 3
+    # The outer stage keeps the peak of the inner one
+    assert STAGES["allocate"][1] >= 10**6
+    assert STAGES["main"][1] >= STAGES["allocate"][1]
+    assert sorted(f.name for f in tmp_path.glob("*.tracemalloc")) == [
+        "profile.txt.0.allocate.tracemalloc",
+        "profile.txt.1.main.tracemalloc",
+    ]
+    assert "allocate: 3 runs, peak" in capsys.readouterr().err
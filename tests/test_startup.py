@@ -0,0 +1,46 @@
+from pathlib import Path
+from subprocess import run
+import sys
+from pytest import mark
+
+ROOT = Path(__file__).parent.parent
+
+# Dependencies every entry point needs, their import time is the floor the
+# entry points are measured against
+FLOOR = "networkx, pydantic.main, typer"
+# (module, modules that must stay deferred, allowed time on top of the floor)
+BUDGETS = [
+    ("paper", ["tqdm", "matplotlib", "faker", "numpy"], 0.35),
+    ("generator", ["tqdm", "matplotlib", "faker", "numpy"], 0.35),
+    ("plot", ["tqdm", "matplotlib", "faker"], 1.0),
+]
+
+
+def import_time(statement: str) -> tuple[int, set[str]]:
+    result = run(
+        [sys.executable, "-X", "importtime", "-c", f"import {statement}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    lines = [
+        line.removeprefix("import time:").split("|")
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    ][1:]
+    total = sum(int(self_time) for self_time, _, _ in lines)
+    return total, {name.strip() for _, _, name in lines}
+
+
+@mark.parametrize("module,deferred,budget", BUDGETS)
+def test_import_time(module: str, deferred: list[str], budget: float):
+    # The floor is measured right before every run, so that both see the same
+    # machine load, and the best of a few runs is kept
+    ratios: list[float] = []
+    for _ in range(5):
+        floor, _ = import_time(FLOOR)
+        total, modules = import_time(module)
+        assert not {*deferred} & modules
+        ratios.append(total / floor)
+    assert min(ratios) <= 1 + budget, f"{module} takes {min(ratios):.2f}x the floor"
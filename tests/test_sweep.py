@@ -0,0 +1,59 @@
+from pathlib import Path
+import networkx as nx
+from pandas import isna
+from benchmarks.synthetic import synthetic_data, synthetic_users
+from cache import ResultCache
+from paper import (
+    Operation,
+    anonymize_data,
+    cached_classes,
+    classes_key,
+    compute_classes,
+    prefix_pattern,
+)
+from sweep import sweep
+
+USERS = synthetic_users(60)
+DATA = synthetic_data(USERS, nx.gnp_random_graph(60, 0.08, seed=42, directed=True))
+
+
+def test_sweep(tmp_path: Path):
+    table = sweep(DATA, [2, 5], [1, 3], workers=2, output_dir=tmp_path)
+    assert len(table) == 6
+    for row in table.itertuples():
+        k = None if isna(row.k) else int(row.k)
+        expected = anonymize_data(
+            DATA, Operation(row.operation), row.m, prefix_pattern(k or 0)
+        )
+        output = tmp_path / (
+            f"{row.operation}-m{row.m}" + ("" if k is None else f"-k{k}") + ".json"
+        )
+        assert output.exists()
+        assert row.classes == len(expected.classes)
+        assert row.distinct == len({c.nodes for c in expected.classes})
+        edges = sum(
+            len({(u.nodes, v.nodes) for u, v in g.edges()})
+            for g in expected.all_graphs().values()
+        )
+        assert row.edges == edges
+
+
+def test_sweep_operations():
+    table = sweep(DATA, [3], [2], [Operation.partitioning])
+    assert [*table["operation"]] == [Operation.partitioning]
+
+
+def test_sweep_cache(tmp_path: Path):
+    cache = ResultCache(tmp_path)
+    table = sweep(DATA, [2, 5], [1], workers=2, cache=cache, digest="digest")
+    # The misses computed by the pool are stored like cached_classes would
+    for m in [2, 5]:
+        assert cache.get(classes_key("digest", m), ".json") is not None
+        assert {*cached_classes(DATA, m, cache, "digest")} == {
+            *compute_classes(DATA, m)
+        }
+    cached = sweep(DATA, [5, 2], [1], workers=2, cache=cache, digest="digest")
+    columns = ["operation", "m", "k", "classes", "distinct", "edges"]
+    assert cached.sort_values(columns)[columns].values.tolist() == (
+        table.sort_values(columns)[columns].values.tolist()
+    )